@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import click
+
+from .utils import DIGEST_BYTES, lazy_import, read_digest
+
+np = lazy_import("numpy")
+
+ANN_MIN_CHUNKS = 20_000
+DEFAULT_NPROBE = 8
+KMEANS_ITERS = 10
+KMEANS_SAMPLE_PER_LIST = 256
+# Retrain once the index has grown this much past the set it was trained on.
+RETRAIN_GROWTH = 4.0
+ASSIGN_BLOCK = 8192
+
+
+def ann_paths(memory_file: Path) -> Tuple[Path, Path]:
+    return (
+        memory_file.with_name(memory_file.stem + ".ivf.f32"),
+        memory_file.with_name(memory_file.stem + ".ivf.i32"),
+    )
+
+
+def _assign(data, centroids):
+    labels = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), ASSIGN_BLOCK):
+        block = np.asarray(data[start:start + ASSIGN_BLOCK], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """IVF-flat index: spherical k-means centroids plus one list id per row.
+
+    Rows are the unit-normalized docs_index matrix, so probing the nprobe
+    closest lists and scoring their members exactly gives approximate top-k.
+    nprobe trades recall for latency; nprobe == nlist is an exact scan.
+    """
+
+    def __init__(self, centroids, assign, trained_on: int) -> None:
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assign = np.asarray(assign, dtype=np.int32)
+        self.trained_on = trained_on
+        self.dirty = False
+        self._order = None
+        self._offsets = None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, data, nlist: int | None = None, iters: int = KMEANS_ITERS, seed: int = 0) -> "IVFIndex":
+        n = len(data)
+        nlist = max(1, min(n, nlist or int(math.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * KMEANS_SAMPLE_PER_LIST)
+        sample = np.asarray(data[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iters):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms[:, None]
+        index = cls(centroids, _assign(data, centroids), trained_on=n)
+        index.dirty = True
+        return index
+
+    def keep(self, rows: Sequence[int]) -> None:
+        self.assign = self.assign[np.asarray(rows, dtype=np.int64)] if len(rows) else self.assign[:0]
+        self._invalidate()
+
+    def add(self, data) -> None:
+        if len(data):
+            self.assign = np.concatenate([self.assign, _assign(data, self.centroids)])
+            self._invalidate()
+
+    def _invalidate(self) -> None:
+        self.dirty = True
+        self._order = None
+        self._offsets = None
+
+    def _lists(self):
+        if self._order is None:
+            self._order = np.argsort(self.assign, kind="stable")
+            self._offsets = np.searchsorted(self.assign[self._order], np.arange(self.nlist + 1))
+        return self._order, self._offsets
+
+    def search(self, data, query: Sequence[float], k: int, nprobe: int = DEFAULT_NPROBE) -> List[Tuple[float, int]]:
+        q = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if k <= 0 or not len(self.assign) or norm == 0 or len(q) != self.centroids.shape[1]:
+            return []
+        q = q / norm
+        nprobe = max(1, min(nprobe, self.nlist))
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        order, offsets = self._lists()
+        rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+        if not len(rows):
+            return []
+        rows.sort()
+        scores = np.asarray(data[rows], dtype=np.float32) @ q
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(float(scores[i]), int(rows[i])) for i in top]
+
+
+def attach_ann(docs_index: Dict[str, Any], memory_file: Path, rows: int) -> None:
+    meta = docs_index.get("ann")
+    if not meta or np is None:
+        return
+    cent_path, assign_path = ann_paths(memory_file)
+    if not cent_path.exists() or not assign_path.exists():
+        return
+    digest = meta.get("digest")
+    trailer = DIGEST_BYTES if digest else 0
+    nlist, dim = int(meta["nlist"]), int(meta["dim"])
+    if (digest and (read_digest(cent_path) != digest or read_digest(assign_path) != digest)) or (
+        cent_path.stat().st_size != nlist * dim * 4 + trailer
+    ):
+        # Chunks changed outside index_files (e.g. a merge took these files
+        # from another commit); fall back to exact search and drop the stale
+        # index on the next save.
+        return
+    centroids = np.fromfile(cent_path, dtype="<f4", count=nlist * dim).reshape(nlist, dim)
+    assign = np.fromfile(assign_path, dtype="<i4", count=(assign_path.stat().st_size - trailer) // 4)
+    if len(assign) != rows:
+        return
+    docs_index["_ann"] = IVFIndex(centroids, assign, trained_on=int(meta.get("trained_on", rows)))
+
+
+def store_ann(docs_index: Dict[str, Any], memory_file: Path, digest: str) -> None:
+    """Save the index if it changed; digest is that of the chunks it is saved with."""
+    index: Optional[IVFIndex] = docs_index.get("_ann")
+    cent_path, assign_path = ann_paths(memory_file)
+    if index is None:
+        if "ann" in docs_index and np is not None:
+            docs_index.pop("ann")
+            for path in (cent_path, assign_path):
+                if path.exists():
+                    path.unlink()
+        return
+    if index.dirty:
+        for path, arr, dtype in ((cent_path, index.centroids, "<f4"), (assign_path, index.assign, "<i4")):
+            tmp = path.with_name(path.name + ".tmp")
+            with tmp.open("wb") as fh:
+                arr.astype(dtype).tofile(fh)
+                fh.write(bytes.fromhex(digest))
+            os.replace(tmp, path)
+        index.dirty = False
+    else:
+        digest = (docs_index.get("ann") or {}).get("digest", "")
+    docs_index["ann"] = {
+        "type": "ivf-flat",
+        "nlist": index.nlist,
+        "dim": int(index.centroids.shape[1]),
+        "trained_on": index.trained_on,
+    }
+    if digest:
+        docs_index["ann"]["digest"] = digest
+
+
+def update_ann(docs_index: Dict[str, Any], matrix: Any, keep: Sequence[int] | None, added: int, min_chunks: int) -> None:
+    """Keep the IVF index in step with docs_index after rows were kept/appended.
+
+    Builds the index once the domain reaches min_chunks (0 disables ANN) and
+    retrains it when it has grown well past the set it was trained on.
+    """
+    if np is None:
+        return
+    index: Optional[IVFIndex] = docs_index.get("_ann")
+    n = len(matrix)
+    if min_chunks <= 0 or n < min_chunks:
+        docs_index.pop("_ann", None)
+        return
+    data = matrix.as_numpy()
+    if index is None or n > index.trained_on * RETRAIN_GROWTH:
+        docs_index["_ann"] = IVFIndex.train(data)
+        return
+    if keep is not None:
+        index.keep(keep)
+    if added:
+        index.add(data[n - added:])
+
+
+def recall_report(
+    data,
+    index: IVFIndex,
+    k: int,
+    nprobes: Sequence[int],
+    queries: int = 200,
+    noise: float = 0.05,
+    seed: int = 0,
+) -> List[Dict[str, float]]:
+    """Measure recall@k and latency of IVF search against an exact scan.
+
+    Queries are perturbed copies of random rows, which approximates real
+    queries landing near indexed content.
+    """
+    rng = np.random.default_rng(seed)
+    n, dim = data.shape
+    picks = rng.choice(n, min(queries, n), replace=False)
+    qs = np.asarray(data[picks], dtype=np.float32) + rng.normal(0, noise, (len(picks), dim)).astype(np.float32)
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+
+    truth = []
+    start = time.perf_counter()
+    for q in qs:
+        scores = data @ q
+        kk = min(k, n)
+        truth.append(set(np.argpartition(-scores, kk - 1)[:kk].tolist()))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(qs)
+
+    report = []
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        results = [index.search(data, q, k, nprobe) for q in qs]
+        ann_ms = (time.perf_counter() - start) * 1000 / len(qs)
+        for expected, found in zip(truth, results):
+            hits += len(expected & {row for _, row in found})
+        report.append(
+            {
+                "nprobe": nprobe,
+                "recall": hits / max(1, sum(len(t) for t in truth)),
+                "ann_ms": ann_ms,
+                "exact_ms": exact_ms,
+            }
+        )
+    return report
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise click.ClickException("The ANN index requires numpy (pip install numpy).")
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import click
+
+from . import tracing
+from .token_budget import count_tokens
+from .utils import ensure_parent
+
+DEFAULT_BATCH_TOKENS = 100_000
+DEFAULT_BATCH_ITEMS = 256
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+def plan_batches(
+    texts: Sequence[str],
+    max_tokens: int = DEFAULT_BATCH_TOKENS,
+    max_items: int = DEFAULT_BATCH_ITEMS,
+    token_counts: Sequence[int] | None = None,
+) -> List[List[int]]:
+    """Greedily pack text positions into batches bounded by tokens and items.
+
+    A single text over max_tokens still gets a batch of its own.
+    """
+    if token_counts is None:
+        token_counts = [count_tokens(t) for t in texts]
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _batch_key(model: str, texts: Sequence[str]) -> str:
+    h = hashlib.sha256(model.encode("utf-8"))
+    for t in texts:
+        h.update(b"\0")
+        h.update(t.encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_checkpoint(path: Path | None) -> Dict[str, List[List[float]]]:
+    """Vectors of the batches a checkpoint file records, by batch key."""
+    if path is None or not path.exists():
+        return {}
+    done: Dict[str, List[List[float]]] = {}
+    with path.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a torn last line; that batch is simply redone.
+                continue
+            done[rec["key"]] = rec["vectors"]
+    return done
+
+
+def _embed_with_retry(client: Any, model: str, texts: List[str], retries: int) -> List[List[float]]:
+    attempt = 0
+    while True:
+        try:
+            with tracing.span("embed.request", model=model, texts=len(texts), attempt=attempt):
+                resp = client.embeddings.create(model=model, input=texts)
+            return [d.embedding for d in resp.data]
+        except Exception:
+            attempt += 1
+            if attempt > retries:
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempt - 1)))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def embed_batched(
+    client: Any,
+    model: str,
+    texts: Sequence[str],
+    max_tokens: int = DEFAULT_BATCH_TOKENS,
+    max_items: int = DEFAULT_BATCH_ITEMS,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    checkpoint: Path | None = None,
+    token_counts: Sequence[int] | None = None,
+    keep_checkpoint: bool = False,
+    resume: Dict[str, List[List[float]]] | None = None,
+) -> List[List[float]]:
+    """Embed texts in concurrent, individually retried batches.
+
+    Finished batches are appended to the checkpoint file (if given) so an
+    interrupted run only re-sends the batches that never completed. The
+    checkpoint is removed once every batch has succeeded, unless the caller
+    embeds in several calls and cleans it up itself (keep_checkpoint); such
+    callers read it once with load_checkpoint and pass it as resume, rather
+    than every call re-reading the growing file.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    batches = plan_batches(texts, max_tokens=max_tokens, max_items=max_items, token_counts=token_counts)
+    done = load_checkpoint(checkpoint) if resume is None else resume
+    results: List[List[float] | None] = [None] * len(texts)
+    pending = []
+    for batch in batches:
+        batch_texts = [texts[i] for i in batch]
+        key = _batch_key(model, batch_texts)
+        vectors = done.get(key)
+        if vectors is not None and len(vectors) == len(batch):
+            for i, vec in zip(batch, vectors):
+                results[i] = vec
+        else:
+            pending.append((key, batch, batch_texts))
+
+    if pending:
+        ckpt_fh = None
+        if checkpoint is not None:
+            ensure_parent(checkpoint)
+            ckpt_fh = checkpoint.open("a", encoding="utf-8")
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = {
+                    pool.submit(_embed_with_retry, client, model, batch_texts, retries): (key, batch)
+                    for key, batch, batch_texts in pending
+                }
+                for fut in as_completed(futures):
+                    key, batch = futures[fut]
+                    try:
+                        vectors = fut.result()
+                    except Exception as exc:  # pragma: no cover - network
+                        for other in futures:
+                            other.cancel()
+                        hint = " Completed batches were checkpointed; rerun to resume." if ckpt_fh else ""
+                        raise click.ClickException(f"Embedding failed: {exc}.{hint}") from exc
+                    for i, vec in zip(batch, vectors):
+                        results[i] = vec
+                    if ckpt_fh is not None:
+                        ckpt_fh.write(json.dumps({"key": key, "vectors": vectors}) + "\n")
+                        ckpt_fh.flush()
+        finally:
+            if ckpt_fh is not None:
+                ckpt_fh.close()
+
+    if checkpoint is not None and not keep_checkpoint and checkpoint.exists():
+        checkpoint.unlink()
+    return results  # type: ignore[return-value]
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List
+
+from .token_budget import count_tokens, tiktoken, token_offsets
+
+# Chunk edges may move back by up to this share of chunk_size to land on a line boundary.
+SNAP_WINDOW = 0.25
+
+
+@dataclass
+class TextSpan:
+    start: int
+    end: int
+    text: str
+    tokens: int
+
+
+def _line_start(text: str, offset: int) -> bool:
+    return offset == 0 or text[offset - 1] == "\n"
+
+
+def _snap_end(text: str, offsets: List[int], start: int, end: int, chunk_size: int) -> int:
+    """Move end back to the best line boundary within the snap window.
+
+    A line starting in column 0 (a top-level def/class/function/export) beats any
+    other line start; with no line start in range the hard token cut is kept.
+    """
+    lo = max(start + 1, end - int(chunk_size * SNAP_WINDOW))
+    fallback = None
+    for i in range(end, lo - 1, -1):
+        off = offsets[i]
+        if not _line_start(text, off):
+            continue
+        if off < len(text) and not text[off].isspace():
+            return i
+        if fallback is None:
+            fallback = i
+    return fallback if fallback is not None else end
+
+
+def chunk_spans(text: str, chunk_size: int = 800, overlap: int = 150) -> List[TextSpan]:
+    """Split text into spans of at most chunk_size tokens, overlapping by overlap.
+
+    The text is encoded once; spans are sliced by token offsets and mapped back
+    to the original characters, so newlines and indentation are kept.
+    """
+    offsets = token_offsets(text)
+    n = len(offsets)
+    if not n:
+        return []
+    offsets.append(len(text))
+    chunk_size = max(1, chunk_size)
+    overlap = max(0, min(overlap, chunk_size - 1))
+    spans: List[TextSpan] = []
+    start = 0
+    while start < n:
+        end = min(n, start + chunk_size)
+        if end < n:
+            end = _snap_end(text, offsets, start, end, chunk_size)
+        piece = text[offsets[start]:offsets[end]]
+        if piece.strip():
+            tokens = end - start if tiktoken else count_tokens(piece)
+            spans.append(TextSpan(offsets[start], offsets[end], piece, tokens))
+        if end == n:
+            break
+        next_start = max(start + 1, end - overlap)
+        # Prefer to open the next chunk on a line start inside the overlap.
+        for i in range(next_start, end):
+            if _line_start(text, offsets[i]):
+                next_start = i
+                break
+        start = next_start
+    return spans
+
+
+def chunk_text(text: str, chunk_size: int = 800, overlap: int = 150) -> List[str]:
+    return [span.text for span in chunk_spans(text, chunk_size=chunk_size, overlap=overlap)]
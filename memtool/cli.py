@@ -1,20 +1,23 @@
 from __future__ import annotations
 
 import json
+import time
 from pathlib import Path
 from typing import List, Dict, Any
 
 import click
-from openai import OpenAI
-from rich import print as rprint
-from rich.table import Table
 
-from .config import load_settings
-from .memory_store import load_memory, save_memory, ensure_memory_files
-from .summarizer import summarize_if_needed
-from .retrieval import retrieve_chunks, index_files
-from .token_budget import messages_token_count, trim_messages_to_budget, count_tokens
-from .git_ops import ensure_repo_and_pull, commit_and_push, require_clean_worktree, push_only
+from . import tracing
+
+# Only light modules are imported here; openai, rich, numpy and the
+# indexing/retrieval stack load inside the commands that use them, so
+# `git-push`, `show` and `--help` start quickly.
+from .config import load_settings, make_client, state_dir
+from .memory_store import MEMORY_FILES, load_memory, save_memory, ensure_memory_files, append_messages, memory_stats, index_summary, recent_messages
+from .summarizer import LONG_TERM_MAX_TOKENS, relevant_sections
+from .token_budget import message_tokens, trim_messages_to_budget, truncate_to_tokens, count_tokens, set_chat_model
+from .git_ops import ensure_repo_and_pull, commit_and_push, commit_local, require_clean_worktree, push_only, sync, sync_due
+from .utils import Timings
 
 DEFAULT_COMMIT_MSG = "chore(memory): update project memory"
 
@@ -29,15 +32,89 @@ def _domain_option(f):
     )(f)
 
 
+def _parse_domains(ctx, param, value: str) -> List[str]:
+    names = list(MEMORY_FILES) if value == "all" else [d.strip() for d in value.split(",") if d.strip()]
+    if not names or any(d not in MEMORY_FILES for d in names):
+        raise click.BadParameter(f"expected 'all' or a comma-separated list of {', '.join(MEMORY_FILES)}")
+    return list(dict.fromkeys(names))
+
+
+def _load_settings():
+    settings = load_settings()
+    set_chat_model(settings.chat_model)
+    return settings
+
+
+def _pull(settings, branch: str | None) -> None:
+    ensure_repo_and_pull(branch, deferred=settings.sync_mode == "deferred")
+
+
+def _commit(settings, branch: str | None) -> bool:
+    """Commit and push now, or in deferred mode queue a local commit and push when a sync is due.
+
+    Returns whether the commit was pushed.
+    """
+    if settings.sync_mode != "deferred":
+        commit_and_push(DEFAULT_COMMIT_MSG, branch)
+        return True
+    commit_local(DEFAULT_COMMIT_MSG)
+    if sync_due(settings.sync_interval):
+        sync(branch)
+        return True
+    return False
+
+
+def _saved(done: str, pushed: bool) -> str:
+    if pushed:
+        return f"{done} and pushed."
+    return f"{done} and committed locally; run `memtool sync` to push."
+
+
 @click.group()
-def cli() -> None:
+@click.option(
+    "--trace",
+    "trace_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    envvar="MEMTOOL_TRACE",
+    help="Write timed spans (git, load/save, embedding, retrieval, completion...) to this JSONL file.",
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    envvar="MEMTOOL_PROFILE",
+    help="Write cProfile stats for the run (main thread) to this file; read with `python -m pstats`.",
+)
+@click.pass_context
+def cli(ctx: click.Context, trace_path: Path | None, profile_path: Path | None) -> None:
     """memtool CLI for GitHub-backed project memory."""
+    if trace_path is not None:
+        tracing.start(trace_path, ctx.invoked_subcommand or "memtool")
+        ctx.call_on_close(tracing.stop)
+    if profile_path is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump() -> None:
+            profiler.disable()
+            profiler.dump_stats(str(profile_path))
+
+        ctx.call_on_close(dump)
 
 
 def build_chat_messages(memory: Dict[str, Any], user_prompt: str, retrieved: List[str], settings) -> List[Dict[str, str]]:
     system_msgs: List[Dict[str, str]] = [{"role": "system", "content": "You are a senior software engineer. Be precise and safe."}]
     if memory.get("long_term_memory"):
-        system_msgs.append({"role": "system", "content": "[PROJECT MEMORY]\n" + memory["long_term_memory"]})
+        # Clipped in case it predates the ceiling or grew in a merge; summarize re-bounds it.
+        long_term = truncate_to_tokens(memory["long_term_memory"], LONG_TERM_MAX_TOKENS)
+        system_msgs.append({"role": "system", "content": "[PROJECT MEMORY]\n" + long_term})
+    sections = relevant_sections(memory, user_prompt)
+    if sections:
+        system_msgs.append({"role": "system", "content": "[EARLIER SUMMARIES]\n" + "\n\n".join(sections)})
     if retrieved:
         system_msgs.append({"role": "system", "content": "[RETRIEVED CONTEXT]\n" + "\n\n".join(retrieved)})
 
@@ -47,62 +124,148 @@ def build_chat_messages(memory: Dict[str, Any], user_prompt: str, retrieved: Lis
     # Trim history to fit budget minus system + headroom.
     system_tokens = sum(count_tokens(m["content"]) for m in system_msgs)
     allowed_for_history = max(0, settings.hard_budget_tokens - system_tokens - 800)
-    trimmed_history = trim_messages_to_budget(history, allowed_for_history)
+    trimmed_history = trim_messages_to_budget(history, allowed_for_history, counts=[message_tokens(m) for m in history])
 
-    return system_msgs + trimmed_history
+    # Stored messages may carry extra keys (e.g. "pinned") the API does not accept.
+    return system_msgs + [{"role": m["role"], "content": m["content"]} for m in trimmed_history]
 
 
 @cli.command()
-@_domain_option
+@click.option(
+    "--domain",
+    "domains",
+    default="global",
+    show_default=True,
+    callback=_parse_domains,
+    help="Memory to chat with. A comma-separated list or 'all' retrieves from every listed domain; history is kept in the first.",
+)
 @click.option("--prompt", required=True, help="User prompt for chat.")
 @click.option("--k", default=6, show_default=True, help="Top-K chunks to retrieve.")
 @click.option("--temperature", default=0.2, show_default=True, help="Model temperature.")
+@click.option("--mode", type=click.Choice(["hybrid", "vector", "lexical"]), default=None, help="Retrieval mode; lexical needs no embedding call (default MEMTOOL_RETRIEVAL_MODE or hybrid).")
+@click.option("--nprobe", type=int, default=None, help="IVF lists to probe when an ANN index exists (0 = exact scan; default MEMTOOL_ANN_NPROBE).")
+@click.option("--pin", is_flag=True, help="Pin this exchange so history trimming never drops it.")
+@click.option("--stream/--no-stream", default=True, show_default=True, help="Render the answer as it is generated.")
 @click.option("--branch", default=None, help="Branch to operate on (default: current).")
-def chat(domain: str, prompt: str, k: int, temperature: float, branch: str | None) -> None:
+def chat(
+    domains: List[str],
+    prompt: str,
+    k: int,
+    temperature: float,
+    mode: str | None,
+    nprobe: int | None,
+    pin: bool,
+    stream: bool,
+    branch: str | None,
+) -> None:
     """Chat with project memory, auto-syncing with GitHub."""
-    settings = load_settings()
-    client = OpenAI()
-    ensure_repo_and_pull(branch)
-    ensure_memory_files()
-    memory = load_memory(domain)
-
-    memory = summarize_if_needed(client, memory, settings.summary_model, settings.hard_budget_tokens)
-
-    retrieved = retrieve_chunks(client, memory, prompt, settings.embed_model, k)
-    messages = build_chat_messages(memory, prompt, retrieved, settings)
-
-    try:
-        resp = client.chat.completions.create(
-            model=settings.chat_model,
-            temperature=temperature,
-            messages=messages,
+    from concurrent.futures import ThreadPoolExecutor
+
+    from rich.console import Console
+    from rich.live import Live
+    from rich.text import Text
+
+    from .completion import complete
+    from .embedding_cache import open_cache
+    from .pipeline import prepare_turn
+    from .retrieval import retrieve_federated
+    from .summarizer import needs_summary, summarize_if_needed
+
+    settings = _load_settings()
+    client = make_client(settings)
+    mode = mode or settings.retrieval_mode
+    domain = domains[0]
+    timings = Timings()
+    memory, query_emb = prepare_turn(client, settings, domain, prompt, mode, lambda: _pull(settings, branch), timings, search=domains)
+
+    with timings.phase("retrieve"):
+        cache = open_cache(settings)
+        retrieved = retrieve_federated(
+            client,
+            {d: memory if d == domain else load_memory(d) for d in domains},
+            prompt,
+            settings.embed_model,
+            k,
+            cache=cache,
+            nprobe=settings.ann_nprobe if nprobe is None else nprobe,
+            mode=mode,
+            query_emb=query_emb,
         )
-    except Exception as exc:  # pragma: no cover - network
-        raise click.ClickException(f"Chat completion failed: {exc}") from exc
-
-    answer = resp.choices[0].message.content.strip()
-    memory.setdefault("messages", []).append({"role": "user", "content": prompt})
-    memory["messages"].append({"role": "assistant", "content": answer})
-
+        if cache is not None:
+            cache.close()
+    with tracing.span("prompt") as s:
+        messages = build_chat_messages(memory, prompt, retrieved, settings)
+        s.set(messages=len(messages), retrieved=len(retrieved))
+
+    console = Console()
+    if stream and console.is_terminal:
+        text = Text()
+        with Live(text, console=console, refresh_per_second=15, vertical_overflow="visible"):
+            result = complete(client, settings.chat_model, messages, temperature, stream=True, on_text=text.append)
+    elif stream:
+        # Piped output gets the raw pieces as they arrive, without redraws.
+        result = complete(client, settings.chat_model, messages, temperature, stream=True, on_text=lambda piece: click.echo(piece, nl=False))
+        click.echo()
+    else:
+        result = complete(client, settings.chat_model, messages, temperature, stream=False)
+        console.print(Text(result.answer))
+    timings.record("first token", result.first_token)
+    timings.record("answer", result.total)
+
+    user_msg: Dict[str, Any] = {"role": "user", "content": prompt}
+    assistant_msg: Dict[str, Any] = {"role": "assistant", "content": result.answer}
+    if pin:
+        user_msg["pinned"] = assistant_msg["pinned"] = True
+    append_messages(memory, [user_msg, assistant_msg])
     save_memory(domain, memory)
-    commit_and_push(DEFAULT_COMMIT_MSG, branch)
-    rprint(answer)
+
+    def finish() -> None:
+        # Summarization is off the hot path: the history was trimmed to the
+        # budget for this turn, and older messages are folded away afterwards.
+        if needs_summary(memory, settings.hard_budget_tokens):
+            click.echo("Summarizing older messages into long-term memory...", err=True)
+            try:
+                summarize_if_needed(client, memory, settings.summary_model, settings.hard_budget_tokens)
+                save_memory(domain, memory)
+            except click.ClickException as exc:
+                click.echo(f"Summarization skipped: {exc.message}", err=True)
+        _commit(settings, branch)
+
+    # The answer is already on screen; summarize, commit and push while the timings print.
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        finishing = pool.submit(finish)
+        click.echo(timings.summary(), err=True)
+        finishing.result()
 
 
 @cli.command("index-files")
 @_domain_option
-@click.option("--chunk-size", default=800, show_default=True, help="Chunk size in tokens (approx).")
+@click.option("--chunk-size", default=800, show_default=True, help="Chunk size in tokens.")
 @click.option("--overlap", default=150, show_default=True, help="Token overlap between chunks.")
 @click.option("--dry-run", is_flag=True, help="Show what would be indexed without embedding.")
+@click.option("--include-ignored", is_flag=True, help="Walk the file system instead of `git ls-files`, including .gitignored files.")
+@click.option("--rebuild", is_flag=True, help="Drop the domain's index and embed PATHS afresh (needed after changing the embedder or model).")
 @click.option("--branch", default=None, help="Branch to operate on (default: current).")
 @click.argument("paths", nargs=-1)
-def index_files_cmd(domain: str, chunk_size: int, overlap: int, dry_run: bool, branch: str | None, paths: tuple[str, ...]) -> None:
+def index_files_cmd(
+    domain: str,
+    chunk_size: int,
+    overlap: int,
+    dry_run: bool,
+    include_ignored: bool,
+    rebuild: bool,
+    branch: str | None,
+    paths: tuple[str, ...],
+) -> None:
     """Index files into the project memory docs_index with secret scrubbing."""
+    from .embedding_cache import open_cache
+    from .retrieval import index_files
+
     if not paths:
         raise click.ClickException("Provide at least one path to index.")
-    settings = load_settings()
-    client = OpenAI()
-    ensure_repo_and_pull(branch)
+    settings = _load_settings()
+    client = make_client(settings)
+    _pull(settings, branch)
     ensure_memory_files()
     path_objs = []
     for p in paths:
@@ -111,11 +274,30 @@ def index_files_cmd(domain: str, chunk_size: int, overlap: int, dry_run: bool, b
         else:
             path_objs.append(Path(p))
     memory = load_memory(domain)
-    memory = index_files(client, memory, path_objs, settings.embed_model, chunk_size, overlap, dry_run=dry_run)
+    cache = open_cache(settings)
+    memory = index_files(
+        client,
+        memory,
+        path_objs,
+        settings.embed_model,
+        chunk_size,
+        overlap,
+        dry_run=dry_run,
+        batch_tokens=settings.embed_batch_tokens,
+        batch_items=settings.embed_batch_items,
+        workers=settings.embed_workers,
+        checkpoint=state_dir() / f"embed_checkpoint_{domain}.jsonl",
+        cache=cache,
+        ann_min_chunks=settings.ann_min_chunks,
+        processes=settings.index_processes or None,
+        use_git=not include_ignored,
+        rebuild=rebuild,
+    )
+    if cache is not None:
+        cache.close()
     if not dry_run:
         save_memory(domain, memory)
-        commit_and_push(DEFAULT_COMMIT_MSG, branch)
-        click.echo("Indexing complete and pushed.")
+        click.echo(_saved("Indexing complete", _commit(settings, branch)))
 
 
 @cli.command()
@@ -123,19 +305,20 @@ def index_files_cmd(domain: str, chunk_size: int, overlap: int, dry_run: bool, b
 @click.option("--force", is_flag=True, help="Force summarization even if under budget.")
 @click.option("--branch", default=None, help="Branch to operate on (default: current).")
 def summarize(domain: str, force: bool, branch: str | None) -> None:
-    """Summarize older messages into long_term_memory."""
-    settings = load_settings()
-    client = OpenAI()
-    ensure_repo_and_pull(branch)
+    """Summarize older messages into summary sections and the long-term digest."""
+    from .summarizer import summarize_if_needed
+
+    settings = _load_settings()
+    client = make_client(settings)
+    _pull(settings, branch)
     ensure_memory_files()
     memory = load_memory(domain)
     if force:
         memory = summarize_if_needed(client, memory, settings.summary_model, 0)
     else:
         memory = summarize_if_needed(client, memory, settings.summary_model, settings.hard_budget_tokens)
-    save_memory(domain, memory)
-    commit_and_push(DEFAULT_COMMIT_MSG, branch)
-    click.echo("Summary saved and pushed.")
+    save_memory(domain, memory, compact=True)
+    click.echo(_saved("Summary saved", _commit(settings, branch)))
 
 
 @cli.command()
@@ -143,25 +326,77 @@ def summarize(domain: str, force: bool, branch: str | None) -> None:
 @click.option("--branch", default=None, help="Branch to operate on (default: current).")
 def show(domain: str, branch: str | None) -> None:
     """Show memory stats and recent messages (no commit)."""
-    settings = load_settings()
-    ensure_repo_and_pull(branch)
+    from rich import print as rprint
+    from rich.table import Table
+
+    from .embedding_cache import open_cache
+
+    settings = _load_settings()
+    _pull(settings, branch)
     ensure_memory_files()
     memory = load_memory(domain)
 
-    lt_tokens = count_tokens(memory.get("long_term_memory", ""))
-    msg_tokens = messages_token_count(memory.get("messages", []))
-    click.echo(f"Long term tokens: {lt_tokens}")
-    click.echo(f"Message tokens: {msg_tokens}")
-    click.echo(f"Docs chunks: {len(memory.get('docs_index', {}).get('chunks', []))}")
+    stats = memory_stats(memory)
+    click.echo(f"Long term tokens: {stats['long_term_tokens']}")
+    click.echo(f"Message tokens: {stats['message_tokens']}")
+    click.echo(f"Summary sections: {len(memory['summaries'])}")
+    docs = index_summary(memory)
+    click.echo(f"Docs chunks: {docs['chunks']}" + (f" (embedder: {docs['embedder']}, {docs['embedding_model']})" if docs["chunks"] else ""))
+    cache = open_cache(settings)
+    if cache is not None:
+        stats = cache.stats()
+        cache.close()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else "n/a"
+        click.echo(
+            f"Embedding cache: {stats['entries']} entries, {stats['bytes'] / 1048576:.1f}/{stats['max_bytes'] / 1048576:.0f} MB, "
+            f"{stats['hits']} hits, {stats['misses']} misses ({hit_rate}), {stats['evictions']} evictions"
+        )
 
     table = Table(title="Last 5 Messages")
     table.add_column("Role")
     table.add_column("Content")
-    for m in memory.get("messages", [])[-5:]:
+    for m in recent_messages(memory, 5):
         table.add_row(m.get("role", ""), m.get("content", "")[:200])
     rprint(table)
 
 
+@cli.command("ann-report")
+@_domain_option
+@click.option("--k", default=6, show_default=True, help="Top-K used for recall@k.")
+@click.option("--nprobe", "nprobes", default="1,2,4,8,16,32", show_default=True, help="Comma-separated nprobe values to measure.")
+@click.option("--queries", default=200, show_default=True, help="Number of sampled queries.")
+@click.option("--nlist", type=int, default=None, help="Train a throwaway index with this many lists instead of the stored one.")
+def ann_report_cmd(domain: str, k: int, nprobes: str, queries: int, nlist: int | None) -> None:
+    """Report ANN recall@k and latency versus exact search (no commit)."""
+    from rich import print as rprint
+    from rich.table import Table
+
+    from .ann import IVFIndex, recall_report, require_numpy
+    from .embedding_store import docs_matrix
+
+    require_numpy()
+    ensure_memory_files()
+    memory = load_memory(domain)
+    idx = memory["docs_index"]
+    matrix = docs_matrix(idx)
+    if not len(matrix):
+        raise click.ClickException(f"Domain '{domain}' has no indexed chunks.")
+    data = matrix.as_numpy()
+    index = idx.get("_ann")
+    if index is None or nlist:
+        click.echo("Training a temporary IVF index (not saved).")
+        index = IVFIndex.train(data, nlist=nlist)
+    report = recall_report(data, index, k, [int(n) for n in nprobes.split(",") if n.strip()], queries=queries)
+
+    table = Table(title=f"IVF recall@{k} ({len(matrix)} chunks, nlist={index.nlist})")
+    for col in ("nprobe", f"recall@{k}", "ANN ms/query", "exact ms/query"):
+        table.add_column(col, justify="right")
+    for row in report:
+        table.add_row(str(row["nprobe"]), f"{row['recall']:.3f}", f"{row['ann_ms']:.2f}", f"{row['exact_ms']:.2f}")
+    rprint(table)
+
+
 @cli.command("git-commit")
 @click.option("--message", default=DEFAULT_COMMIT_MSG, show_default=True, help="Commit message.")
 @click.option("--branch", default=None, help="Branch to operate on (default: current).")
@@ -182,5 +417,33 @@ def git_push_cmd(branch: str | None) -> None:
     click.echo("Push complete.")
 
 
+@cli.command("sync")
+@click.option("--branch", default=None, help="Branch to push (default: current).")
+@click.option("--watch", is_flag=True, help="Keep running and sync every --interval seconds.")
+@click.option("--interval", default=300, show_default=True, envvar="MEMTOOL_SYNC_INTERVAL", help="Seconds between syncs with --watch.")
+def sync_cmd(branch: str | None, watch: bool, interval: int) -> None:
+    """Push memory commits queued by MEMTOOL_SYNC=deferred."""
+    ensure_repo_and_pull(branch, deferred=True)
+    while True:
+        pushed = sync(branch)
+        click.echo(f"Synced ({pushed} commit{'s' if pushed != 1 else ''} pushed)." if pushed else "Already in sync.")
+        if not watch:
+            return
+        time.sleep(max(1, interval))
+
+
+@cli.command("merge-driver", hidden=True)
+@click.argument("base", type=click.Path(path_type=Path))
+@click.argument("ours", type=click.Path(path_type=Path))
+@click.argument("theirs", type=click.Path(path_type=Path))
+@click.argument("name")
+def merge_driver_cmd(base: Path, ours: Path, theirs: Path, name: str) -> None:
+    """git merge driver for project_memory files (see .gitattributes)."""
+    from .merge import merge_file
+
+    if not merge_file(base, ours, theirs, name):
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     cli()
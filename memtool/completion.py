@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+from . import tracing
+from .token_budget import count_tokens
+
+
+@dataclass
+class Completion:
+    answer: str
+    # Seconds from sending the request to the first content token, and to the end.
+    first_token: float
+    total: float
+
+
+def complete(
+    client: Any,
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    stream: bool = True,
+    on_text: Optional[Callable[[str], None]] = None,
+) -> Completion:
+    """Run one chat completion, passing streamed pieces to on_text as they arrive.
+
+    Without streaming the whole answer is one piece, so first_token == total.
+    """
+    start = time.perf_counter()
+    first_token: Optional[float] = None
+    parts: List[str] = []
+    with tracing.span("completion", model=model, stream=stream, messages=len(messages)) as s:
+        if tracing.enabled():
+            s.set(tokens_sent=sum(count_tokens(m.get("content", "")) for m in messages))
+        try:
+            resp = client.chat.completions.create(model=model, temperature=temperature, messages=messages, stream=stream)
+            if stream:
+                for chunk in resp:
+                    # Usage-only chunks have no choices; role/finish chunks no content.
+                    piece = chunk.choices[0].delta.content if chunk.choices else None
+                    if not piece:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    parts.append(piece)
+                    if on_text is not None:
+                        on_text(piece)
+            else:
+                parts.append(resp.choices[0].message.content or "")
+                if on_text is not None:
+                    on_text(parts[0])
+        except Exception as exc:  # pragma: no cover - network
+            raise click.ClickException(f"Chat completion failed: {exc}") from exc
+        if first_token is not None:
+            s.set(first_token_ms=round(first_token * 1000, 3))
+    total = time.perf_counter() - start
+    return Completion("".join(parts).strip(), total if first_token is None else first_token, total)
@@ -1,9 +1,11 @@
 import os
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 
 import click
-from dotenv import load_dotenv
+
+SYNC_MODES = ("immediate", "deferred")
 
 
 @dataclass
@@ -12,25 +14,105 @@ class Settings:
     chat_model: str = "gpt-4o-mini"
     summary_model: str = "gpt-4o-mini"
     embed_model: str = "text-embedding-3-small"
+    embedder: str = "openai"
     hard_budget_tokens: int = 6000
     default_branch: str | None = None
+    embed_batch_tokens: int = 100_000
+    embed_batch_items: int = 256
+    embed_workers: int = 4
+    embed_cache_mb: int = 512
+    ann_min_chunks: int = 20_000
+    ann_nprobe: int = 8
+    index_processes: int = 0
+    retrieval_mode: str = "hybrid"
+    sync_mode: str = "immediate"
+    sync_interval: int = 300
+    fake_openai: bool = False
 
 
 def load_settings() -> Settings:
+    from dotenv import load_dotenv
+
+    from .embedders import DEFAULT_LOCAL_DIM, EMBEDDERS, local_model
+
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    fake_openai = os.getenv("MEMTOOL_FAKE_OPENAI", "").lower() in ("1", "true", "yes")
+    embedder = os.getenv("MEMTOOL_EMBEDDER", "openai").lower()
+    if embedder not in EMBEDDERS:
+        raise click.ClickException(f"MEMTOOL_EMBEDDER must be one of {', '.join(EMBEDDERS)} (got '{embedder}').")
+    # Local embeddings need no key; chat and summarize still do when they call the API.
+    if not api_key and not fake_openai and embedder != "local":
         raise click.ClickException("OPENAI_API_KEY is required (set in environment or .env, never committed).")
+    if embedder == "local":
+        embed_model = local_model(int(os.getenv("MEMTOOL_LOCAL_EMBED_DIM", str(DEFAULT_LOCAL_DIM))))
+    else:
+        embed_model = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+    sync_mode = os.getenv("MEMTOOL_SYNC", "immediate").lower()
+    if sync_mode not in SYNC_MODES:
+        raise click.ClickException(f"MEMTOOL_SYNC must be one of {', '.join(SYNC_MODES)} (got '{sync_mode}').")
 
     return Settings(
-        openai_api_key=api_key,
+        openai_api_key=api_key or "",
         chat_model=os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini"),
         summary_model=os.getenv("OPENAI_SUMMARY_MODEL", "gpt-4o-mini"),
-        embed_model=os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small"),
+        embed_model=embed_model,
+        embedder=embedder,
         hard_budget_tokens=int(os.getenv("HARD_BUDGET_TOKENS", "6000")),
         default_branch=os.getenv("MEMTOOL_DEFAULT_BRANCH"),
+        embed_batch_tokens=int(os.getenv("MEMTOOL_EMBED_BATCH_TOKENS", "100000")),
+        embed_batch_items=int(os.getenv("MEMTOOL_EMBED_BATCH_ITEMS", "256")),
+        embed_workers=int(os.getenv("MEMTOOL_EMBED_WORKERS", "4")),
+        embed_cache_mb=int(os.getenv("MEMTOOL_EMBED_CACHE_MB", "512")),
+        ann_min_chunks=int(os.getenv("MEMTOOL_ANN_MIN_CHUNKS", "20000")),
+        ann_nprobe=int(os.getenv("MEMTOOL_ANN_NPROBE", "8")),
+        index_processes=int(os.getenv("MEMTOOL_INDEX_PROCESSES", "0")),
+        retrieval_mode=os.getenv("MEMTOOL_RETRIEVAL_MODE", "hybrid"),
+        sync_mode=sync_mode,
+        sync_interval=int(os.getenv("MEMTOOL_SYNC_INTERVAL", "300")),
+        fake_openai=fake_openai,
     )
 
 
+def _build_client(settings: Settings):
+    if settings.fake_openai:
+        from .fakes import FakeOpenAI
+
+        return FakeOpenAI()
+    from openai import OpenAI
+
+    return OpenAI()
+
+
+class LazyClient:
+    """Stands in for the client and builds it on first attribute access.
+
+    Commands that end up not calling the API (lexical retrieval, nothing to
+    summarize) never import openai.
+    """
+
+    def __init__(self, settings: Settings) -> None:
+        self._settings = settings
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = _build_client(self._settings)
+        return getattr(self._client, name)
+
+
+def make_client(settings: Settings) -> LazyClient:
+    """Return the OpenAI client, or the offline fake when MEMTOOL_FAKE_OPENAI is set."""
+    return LazyClient(settings)
+
+
 def repo_root() -> Path:
     return Path.cwd()
+
+
+def state_dir() -> Path:
+    """Local, uncommitted working state (checkpoints, caches)."""
+    return repo_root() / ".memtool"
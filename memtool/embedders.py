@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import math
+import re
+import zlib
+from collections import Counter
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+import click
+
+from .lexical import tokenize
+from .utils import lazy_import
+
+np = lazy_import("numpy")
+
+EMBEDDERS = ("openai", "local")
+LOCAL_PREFIX = "local-hashing-"
+DEFAULT_LOCAL_DIM = 512
+
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API (or the offline fake client)."""
+
+    name = "openai"
+    # Network calls: batched, retried, checkpointed and cached by the callers.
+    remote = True
+
+    def __init__(self, client: Any, model: str) -> None:
+        self.client = client
+        self.id = model
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        resp = self.client.embeddings.create(model=self.id, input=texts)
+        return [d.embedding for d in resp.data]
+
+
+class HashingEmbedder:
+    """Local CPU embedder: signed feature hashing of identifier tokens.
+
+    Each word and its camelCase/snake_case parts (as in BM25) plus each pair of
+    adjacent words is hashed into one of dim buckets with a hash-derived sign;
+    counts are square-rooted and the vector unit-normalized. Deterministic, no
+    network and no model files, so indexes built anywhere agree.
+    """
+
+    name = "local"
+    remote = False
+
+    def __init__(self, dim: int = DEFAULT_LOCAL_DIM) -> None:
+        if dim <= 0:
+            raise click.ClickException(f"Local embedding dimension must be positive (got {dim}).")
+        self.dim = dim
+        self.id = local_model(dim)
+
+    def features(self, text: str) -> Tuple[List[int], List[float]]:
+        """Bucket index and signed weight of each distinct hashed feature of text."""
+        words = _WORD.findall(text)
+        buckets: List[int] = []
+        weights: List[float] = []
+        # Each distinct word is hashed once, with its parts cached across texts.
+        for word, n in Counter(words).items():
+            for bucket, sign in _word_features(word, self.dim):
+                buckets.append(bucket)
+                weights.append(sign * n)
+        lowers = [w.lower() for w in words]
+        for pair, n in Counter(zip(lowers, lowers[1:])).items():
+            bucket, sign = _hashed(" ".join(pair), self.dim)
+            buckets.append(bucket)
+            weights.append(sign * n)
+        return buckets, weights
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    def _vector(self, text: str) -> List[float]:
+        buckets, weights = self.features(text)
+        if np is not None:
+            counts = np.bincount(np.asarray(buckets, dtype=np.int64), weights=weights, minlength=self.dim)
+            vec = np.sign(counts) * np.sqrt(np.abs(counts))
+            norm = float(np.linalg.norm(vec))
+            return (vec / norm).tolist() if norm else vec.tolist()
+        counts = [0.0] * self.dim
+        for bucket, weight in zip(buckets, weights):
+            counts[bucket] += weight
+        vec = [math.copysign(math.sqrt(abs(c)), c) for c in counts]
+        norm = math.sqrt(sum(x * x for x in vec))
+        return [x / norm for x in vec] if norm else vec
+
+
+def _hashed(token: str, dim: int) -> Tuple[int, float]:
+    h = zlib.crc32(token.encode("utf-8"))
+    return h % dim, -1.0 if h & 0x80000000 else 1.0
+
+
+@lru_cache(maxsize=65536)
+def _word_features(word: str, dim: int) -> Tuple[Tuple[int, float], ...]:
+    return tuple(_hashed(t, dim) for t in tokenize(word))
+
+
+def embedder_name(model: Optional[str]) -> str:
+    """Which embedder an embedding model id (as stored in docs_index) belongs to."""
+    return "local" if (model or "").startswith(LOCAL_PREFIX) else "openai"
+
+
+def local_model(dim: int) -> str:
+    return f"{LOCAL_PREFIX}{dim}"
+
+
+def get_embedder(client: Any, model: str) -> Any:
+    """The embedder for a model id: local-hashing-<dim> runs locally, anything else is an OpenAI model."""
+    if embedder_name(model) == "local":
+        dim = model[len(LOCAL_PREFIX):]
+        if not dim.isdigit():
+            raise click.ClickException(f"Bad local embedding model id '{model}' (expected {LOCAL_PREFIX}<dim>).")
+        return HashingEmbedder(int(dim))
+    return OpenAIEmbedder(client, model)
+
+
+def _describe(model: str) -> str:
+    if embedder_name(model) == "local":
+        return f"the local hashing embedder ({model})"
+    return f"OpenAI model {model}"
+
+
+def require_same_embedder(indexed: Optional[str], model: str, what: str, hint: str) -> None:
+    """Refuse to mix vectors from different embedders (or models) in one index or query."""
+    if indexed and indexed != model:
+        raise click.ClickException(
+            f"{what} holds embeddings from {_describe(indexed)}, but {_describe(model)} is configured. {hint}"
+        )
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import time
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from .config import Settings, state_dir
+from .utils import ensure_parent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model, sha256(text)) with LRU eviction.
+
+    Shared by index_files and retrieve_chunks. Hit/miss counters persist in the
+    cache file so `memtool show` can report them across runs.
+    """
+
+    def __init__(self, path: Path, max_bytes: int) -> None:
+        ensure_parent(path)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(str(path))
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "EmbeddingCache":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            part = unique[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT key, vector FROM entries WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            for key, blob in rows:
+                vec = array("f")
+                vec.frombytes(blob)
+                found[key] = vec.tolist()
+        if found:
+            now = time.time_ns()
+            self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+        hits = sum(1 for k in keys if k in found)
+        self._bump(hits=hits, misses=len(keys) - hits)
+        self._db.commit()
+        return found
+
+    def put_many(self, items: Dict[str, Sequence[float]]) -> None:
+        now = time.time_ns()
+        rows = []
+        for key, vec in items.items():
+            blob = array("f", vec).tobytes()
+            rows.append((key, blob, len(blob), now))
+        self._db.executemany("INSERT OR REPLACE INTO entries (key, vector, size, last_used) VALUES (?, ?, ?, ?)", rows)
+        self._evict()
+        self._db.commit()
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        self._bump(evictions=len(doomed))
+
+    def _bump(self, **deltas: int) -> None:
+        for name, delta in deltas.items():
+            if delta:
+                self._db.execute(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (name, delta),
+                )
+
+    def stats(self) -> Dict[str, int]:
+        entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        counters = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+        }
+
+
+def embed_cached(
+    cache: Optional[EmbeddingCache],
+    model: str,
+    texts: Sequence[str],
+    embed: Callable[[List[str]], List[List[float]]],
+) -> List[List[float]]:
+    """Serve texts from the cache and embed only the distinct misses."""
+    if cache is None:
+        return embed(list(texts))
+    keys = [cache_key(model, t) for t in texts]
+    found = cache.get_many(keys)
+    missing: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    if missing:
+        vectors = embed(list(missing.values()))
+        fresh = dict(zip(missing.keys(), vectors))
+        cache.put_many(fresh)
+        found.update(fresh)
+    return [found[k] for k in keys]
+
+
+def open_cache(settings: Settings) -> Optional[EmbeddingCache]:
+    if settings.embed_cache_mb <= 0:
+        return None
+    return EmbeddingCache(state_dir() / "embed_cache.sqlite3", settings.embed_cache_mb * 1024 * 1024)
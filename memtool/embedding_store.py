@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import math
+import mmap
+import os
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence
+
+import click
+
+from .utils import DIGEST_BYTES, lazy_import, read_digest
+
+np = lazy_import("numpy")
+
+VECTORS_SUFFIX = ".vectors.f32"
+ITEM_SIZE = 4  # float32
+
+
+def vectors_path(memory_file: Path) -> Path:
+    return memory_file.with_name(memory_file.stem + VECTORS_SUFFIX)
+
+
+def _normalized(vec: Sequence[float], dim: int) -> List[float]:
+    if len(vec) != dim:
+        return [0.0] * dim
+    norm = math.sqrt(sum(x * x for x in vec))
+    if norm == 0:
+        return [0.0] * dim
+    return [x / norm for x in vec]
+
+
+class EmbeddingMatrix:
+    """Row-aligned float32 embeddings for docs_index chunks.
+
+    Rows are stored unit-normalized so cosine similarity is a plain dot product.
+    Matrices opened from disk are read-only memory maps; the first mutation
+    copies them into an in-memory buffer and marks the matrix dirty.
+    """
+
+    def __init__(self, dim: int, buf: Any = None, dirty: bool = False) -> None:
+        self.dim = dim
+        self._buf = buf if buf is not None else array("f")
+        self.dirty = dirty
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[float]], dim: int = 0) -> "EmbeddingMatrix":
+        rows = list(rows)
+        if not dim:
+            dim = next((len(r) for r in rows if r), 0)
+        matrix = cls(dim, dirty=True)
+        matrix.extend(rows)
+        return matrix
+
+    @classmethod
+    def open(cls, path: Path, dim: int, count: int, trailer: int = 0) -> "EmbeddingMatrix":
+        """Map count x dim rows from path, which ends with `trailer` bytes of digest."""
+        if not count or not dim:
+            return cls(dim)
+        if not path.exists():
+            raise click.ClickException(f"Embedding file missing: {path}")
+        expected = dim * count * ITEM_SIZE
+        actual = path.stat().st_size
+        if actual != expected + trailer:
+            raise click.ClickException(
+                f"Embedding file {path} has {actual} bytes, expected {expected + trailer} ({count} x {dim}). Re-index to repair."
+            )
+        with path.open("rb") as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)[:expected].cast("f")
+        if sys.byteorder != "little":
+            swapped = array("f", view)
+            swapped.byteswap()
+            return cls(dim, swapped)
+        return cls(dim, view)
+
+    def __len__(self) -> int:
+        return len(self._buf) // self.dim if self.dim else 0
+
+    def row(self, i: int) -> Sequence[float]:
+        return self._buf[i * self.dim:(i + 1) * self.dim]
+
+    def rows(self) -> Iterable[Sequence[float]]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def as_numpy(self):
+        if np is None:
+            raise RuntimeError("numpy is not installed")
+        return np.frombuffer(self._buf, dtype=np.float32).reshape(len(self), self.dim)
+
+    def _writable(self) -> array:
+        if not isinstance(self._buf, array):
+            self._buf = array("f", self._buf)
+        self.dirty = True
+        return self._buf
+
+    def extend(self, rows: Iterable[Sequence[float]]) -> None:
+        buf = self._writable()
+        for vec in rows:
+            if not self.dim:
+                self.dim = len(vec)
+            buf.extend(_normalized(vec, self.dim))
+
+    def extend_normalized(self, other: "EmbeddingMatrix") -> None:
+        if not len(other):
+            return
+        if not self.dim:
+            self.dim = other.dim
+        self._writable().extend(other._buf)
+
+    def keep(self, rows: Sequence[int]) -> None:
+        """Keep only the given row positions, in the given order."""
+        dim = self.dim
+        kept = array("f")
+        for i in rows:
+            kept.extend(self._buf[i * dim:(i + 1) * dim])
+        self._buf = kept
+        self.dirty = True
+
+    def save(self, path: Path, digest: str = "") -> None:
+        """Write the rows, followed by the chunks digest when one is given."""
+        tmp = path.with_name(path.name + ".tmp")
+        data = self._buf if isinstance(self._buf, array) else array("f", self._buf)
+        if sys.byteorder != "little":
+            data = array("f", data)
+            data.byteswap()
+        with tmp.open("wb") as fh:
+            data.tofile(fh)
+            fh.write(bytes.fromhex(digest))
+        os.replace(tmp, path)
+        self.dirty = False
+
+
+def docs_matrix(docs_index: Dict[str, Any]) -> EmbeddingMatrix:
+    if docs_index.get("_stale"):
+        raise click.ClickException(docs_index["_stale"])
+    matrix = docs_index.get("_matrix")
+    if matrix is None:
+        matrix = EmbeddingMatrix(int(docs_index.get("vectors", {}).get("dim", 0)))
+        docs_index["_matrix"] = matrix
+    return matrix
+
+
+def attach_vectors(docs_index: Dict[str, Any], memory_file: Path) -> None:
+    """Attach the sidecar matrix, migrating inline JSON embeddings if present."""
+    chunks = docs_index.get("chunks", [])
+    if any("embedding" in ch for ch in chunks):
+        rows = [ch.pop("embedding", None) or [] for ch in chunks]
+        docs_index["_matrix"] = EmbeddingMatrix.from_rows(rows)
+        return
+    meta = docs_index.get("vectors") or {}
+    count = int(meta.get("count", 0))
+    if count != len(chunks):
+        raise click.ClickException(
+            f"docs_index in {memory_file} lists {len(chunks)} chunks but {count} embeddings. Re-index to repair."
+        )
+    path = vectors_path(memory_file)
+    digest = meta.get("digest")
+    if count and digest and read_digest(path) != digest:
+        # Git took the sidecar from another commit than docs_index (a merge
+        # only runs the driver on files both sides changed): its rows belong
+        # to other chunks. index_files re-embeds; vector search refuses.
+        docs_index["_stale"] = (
+            f"The embeddings in {path.name} do not match the chunks in the docs index (the files come from "
+            "different commits). Run `memtool index-files` to re-embed them, or use --mode lexical."
+        )
+        return
+    docs_index["_matrix"] = EmbeddingMatrix.open(path, int(meta.get("dim", 0)), count, DIGEST_BYTES if digest else 0)
+
+
+def store_vectors(docs_index: Dict[str, Any], memory_file: Path, digest: str) -> None:
+    """Save the matrix if it changed; digest is that of the chunks it is saved with."""
+    matrix = docs_index.get("_matrix")
+    if matrix is None:
+        return
+    path = vectors_path(memory_file)
+    if matrix.dirty:
+        matrix.save(path, digest)
+    else:
+        digest = (docs_index.get("vectors") or {}).get("digest", "")
+    docs_index["vectors"] = {"file": path.name, "dim": matrix.dim, "count": len(matrix), "dtype": "float32"}
+    if digest:
+        docs_index["vectors"]["digest"] = digest
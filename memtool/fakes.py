@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List
+
+
+@dataclass
+class _Embedding:
+    embedding: List[float]
+    index: int
+
+
+@dataclass
+class _EmbeddingResponse:
+    data: List[_Embedding]
+    model: str
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+
+
+@dataclass
+class _FakeEmbeddings:
+    owner: "FakeOpenAI"
+
+    def create(self, model: str, input: List[str] | str, **_: object) -> _EmbeddingResponse:
+        owner = self.owner
+        texts = [input] if isinstance(input, str) else list(input)
+        with owner._lock:
+            owner.embedding_calls += 1
+            owner.embedded_texts += len(texts)
+            fail = owner._rng.random() < owner.failure_rate
+        if owner.latency:
+            time.sleep(owner.latency + owner.latency_per_item * len(texts))
+        if fail:
+            raise RuntimeError("fake transient embedding failure")
+        return _EmbeddingResponse(
+            data=[_Embedding(fake_embedding(t, owner.dim), i) for i, t in enumerate(texts)],
+            model=model,
+        )
+
+
+@dataclass
+class _Message:
+    content: str
+    role: str = "assistant"
+
+
+@dataclass
+class _Delta:
+    content: str | None = None
+
+
+@dataclass
+class _Choice:
+    message: _Message | None = None
+    delta: _Delta | None = None
+    index: int = 0
+
+
+@dataclass
+class _Completion:
+    choices: List[_Choice]
+    model: str
+
+
+def fake_answer(messages: List[Dict[str, str]]) -> str:
+    prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    context = sum(len(m.get("content", "")) for m in messages if m.get("role") == "system")
+    return f"Fake answer to '{prompt}', drawing on {len(messages)} messages and {context} characters of context."
+
+
+@dataclass
+class _FakeCompletions:
+    owner: "FakeOpenAI"
+
+    def create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **_: object):
+        owner = self.owner
+        with owner._lock:
+            owner.chat_calls += 1
+        answer = fake_answer(messages)
+        if not stream:
+            time.sleep(owner.first_token_latency + owner.token_interval * len(answer.split()))
+            return _Completion([_Choice(message=_Message(answer))], model)
+        return self._stream(answer, model)
+
+    def _stream(self, answer: str, model: str) -> Iterator[_Completion]:
+        time.sleep(self.owner.first_token_latency)
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.owner.token_interval)
+            yield _Completion([_Choice(delta=_Delta(word if i == len(words) - 1 else word + " "))], model)
+
+
+@dataclass
+class _FakeChat:
+    owner: "FakeOpenAI"
+
+    def __post_init__(self) -> None:
+        self.completions = _FakeCompletions(self.owner)
+
+
+@dataclass
+class FakeOpenAI:
+    """Offline stand-in for openai.OpenAI.
+
+    Embeddings are deterministic per text. latency/failure_rate simulate a slow,
+    flaky endpoint so batching and retries can be measured without network.
+    Chat completions echo the prompt, streamed word by word when stream=True,
+    with first_token_latency/token_interval standing in for model speed.
+    """
+
+    dim: int = 1536
+    latency: float = 0.0
+    latency_per_item: float = 0.0
+    failure_rate: float = 0.0
+    first_token_latency: float = 0.0
+    token_interval: float = 0.0
+    seed: int = 0
+    chat_calls: int = 0
+    embedding_calls: int = 0
+    embedded_texts: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+        self.embeddings = _FakeEmbeddings(self)
+        self.chat = _FakeChat(self)
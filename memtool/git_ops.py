@@ -1,84 +1,221 @@
 from __future__ import annotations
 
 import subprocess
+import sys
+import time
 from pathlib import Path
-from typing import Iterable, List
+from typing import Any, Dict, Iterable, List, Tuple
 
 import click
 
-from .config import repo_root
+from . import tracing
+from .config import repo_root, state_dir
 from .secret_scrubber import staged_has_excluded
+from .utils import read_json, write_json
 
 
 def _run_git(args: list[str], check: bool = True, capture_output: bool = False) -> subprocess.CompletedProcess:
-    return subprocess.run(
-        ["git", *args],
-        cwd=repo_root(),
-        check=check,
-        capture_output=capture_output,
-        text=True,
+    tracing.count("subprocesses")
+    with tracing.span("git", command=args[0]) as s:
+        proc = subprocess.run(
+            ["git", *args],
+            cwd=repo_root(),
+            check=check,
+            capture_output=capture_output,
+            text=True,
+        )
+        s.set(returncode=proc.returncode)
+        return proc
+
+
+def _git_out(args: list[str]) -> str | None:
+    proc = _run_git(args, check=False, capture_output=True)
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def _upstream() -> Tuple[str, str, str] | None:
+    """(remote, remote ref, local tracking ref) of the current branch's upstream."""
+    head = _git_out(["symbolic-ref", "-q", "HEAD"])
+    if not head:
+        return None
+    out = _git_out(["for-each-ref", "--format=%(upstream:remotename) %(upstream:remoteref) %(upstream)", head])
+    parts = (out or "").split()
+    return (parts[0], parts[1], parts[2]) if len(parts) == 3 else None
+
+
+def _is_ancestor(commit: str, of: str) -> bool:
+    return _run_git(["merge-base", "--is-ancestor", commit, of], check=False).returncode == 0
+
+
+def install_merge_driver() -> None:
+    """Register the memtool merge driver named in .gitattributes for this clone."""
+    driver = f'"{sys.executable}" -m memtool.cli merge-driver %O %A %B %P'
+    if _git_out(["config", "--get", "merge.memtool.driver"]) != driver:
+        _run_git(["config", "merge.memtool.name", "memtool project memory merge"])
+        _run_git(["config", "merge.memtool.driver", driver])
+
+
+def _no_upstream() -> str:
+    branch = _git_out(["symbolic-ref", "-q", "--short", "HEAD"])
+    if not branch:
+        return "HEAD is detached, so there is no upstream to pull from. Check out a branch first."
+    return (
+        f"Branch '{branch}' has no upstream configured, so there is nothing to pull from or push to. "
+        f"Set one with `git push -u <remote> {branch}` or `git branch --set-upstream-to=<remote>/{branch}`."
     )
 
 
-def ensure_repo_and_pull(branch: str | None = None) -> None:
+def pull_if_moved() -> None:
+    """Fetch and rebase onto the upstream, skipping whatever is already up to date.
+
+    `git ls-remote` of the upstream ref is compared with the local tracking ref
+    first, so an unchanged remote costs one round trip instead of a full fetch.
+    """
+    upstream = _upstream()
+    if upstream is None:
+        if _git_out(["rev-parse", "-q", "--verify", "@{u}"]) is None:
+            raise click.ClickException(_no_upstream())
+        _run_git(["fetch", "--all", "--prune"])
+        ref = "@{u}"
+    else:
+        remote, remote_ref, ref = upstream
+        listed = _git_out(["ls-remote", remote, remote_ref]) or ""
+        remote_sha = listed.split()[0] if listed else None
+        if remote_sha is None or remote_sha != _git_out(["rev-parse", "-q", "--verify", ref]):
+            _run_git(["fetch", "--prune", remote])
+        if _is_ancestor(ref, "HEAD"):
+            return
+    install_merge_driver()
+    try:
+        _run_git(["rebase", ref])
+    except subprocess.CalledProcessError as exc:
+        raise click.ClickException("git rebase onto the upstream failed (possible conflicts). Resolve conflicts then retry.") from exc
+
+
+def ensure_repo_and_pull(branch: str | None = None, deferred: bool = False) -> None:
     try:
-        _run_git(["rev-parse", "--is-inside-work-tree"])
+        _run_git(["rev-parse", "--is-inside-work-tree"], capture_output=True)
     except subprocess.CalledProcessError:
         raise click.ClickException("Not inside a git repository. Run memtool from within a repo.")
 
-    status = _run_git(["status", "--porcelain"], capture_output=True).stdout.strip()
     if branch:
+        status = _run_git(["status", "--porcelain"], capture_output=True).stdout.strip()
         if status:
             raise click.ClickException("Working tree is dirty. Commit or stash changes before switching branch.")
         _run_git(["checkout", branch])
-    _run_git(["fetch", "--all", "--prune"])
-    try:
-        _run_git(["pull", "--rebase"])
-    except subprocess.CalledProcessError as exc:
-        raise click.ClickException("git pull --rebase failed (possible conflicts). Resolve conflicts then retry.") from exc
+    if deferred:
+        # Deferred mode pulls when it syncs, not on every command.
+        return
+    pull_if_moved()
 
 
 def stage_allowed() -> None:
     allowed = [
         "project_memory/*.json",
+        "project_memory/*.jsonl",
+        "project_memory/*.md",
+        "project_memory/*.f32",
+        "project_memory/*.i32",
         "memtool/**",
         "README.md",
         ".env.example",
         ".gitignore",
     ]
-    _run_git(["add", *allowed])
-
-
-def ensure_no_excluded_staged() -> None:
+    # `git add` fails on a pattern that matches nothing (e.g. no ANN sidecars
+    # yet), so resolve the patterns first; --cached keeps deleted files.
+    listed = _run_git(
+        ["ls-files", "-z", "--cached", "--others", "--exclude-standard", "--", *allowed], capture_output=True
+    ).stdout
+    paths = [p for p in listed.split("\0") if p]
+    if paths:
+        _run_git(["add", "-A", "--", *paths])
+
+
+def ensure_no_excluded_staged() -> List[str]:
+    """Return the staged paths, refusing if any of them is excluded."""
     staged = _run_git(["diff", "--cached", "--name-only"], capture_output=True).stdout.splitlines()
     bad = staged_has_excluded(staged)
     if bad:
         raise click.ClickException(f"Refusing to commit excluded paths: {', '.join(bad)}")
+    return staged
 
 
-def commit_and_push(message: str, branch: str | None = None) -> None:
-    stage_allowed()
-    ensure_no_excluded_staged()
-    staged = _run_git(["diff", "--cached", "--name-only"], capture_output=True).stdout.strip()
-    if not staged:
-        return
-    _run_git(["commit", "-m", message])
+def _push(branch: str | None) -> None:
     try:
         _run_git(["push"] + (["origin", branch] if branch else []))
         return
     except subprocess.CalledProcessError:
         # retry once after rebase
-        _run_git(["fetch", "--all", "--prune"])
         try:
-            _run_git(["pull", "--rebase"])
-        except subprocess.CalledProcessError as exc:
-            raise click.ClickException("Push rejected and rebase failed. Resolve manually and retry.") from exc
+            pull_if_moved()
+        except click.ClickException as exc:
+            raise click.ClickException(f"Push rejected and rebase failed: {exc.message}") from exc
         try:
             _run_git(["push"] + (["origin", branch] if branch else []))
         except subprocess.CalledProcessError as exc:
             raise click.ClickException("Push failed after retry. Resolve manually then rerun.") from exc
 
 
+def commit_and_push(message: str, branch: str | None = None) -> None:
+    stage_allowed()
+    if not ensure_no_excluded_staged():
+        return
+    _run_git(["commit", "-m", message])
+    _push(branch)
+
+
+def _sync_state_path() -> Path:
+    return state_dir() / "sync.json"
+
+
+def _load_sync_state() -> Dict[str, Any]:
+    return read_json(_sync_state_path(), {})
+
+
+def commit_local(message: str) -> bool:
+    """Commit staged memory changes without pushing, coalescing unpushed memtool commits.
+
+    If HEAD is the commit this command made last time and it has not reached the
+    upstream yet, it is amended instead of adding another commit. Returns
+    whether anything was committed.
+    """
+    stage_allowed()
+    if not ensure_no_excluded_staged():
+        return False
+    state = _load_sync_state()
+    head = _git_out(["rev-parse", "-q", "--verify", "HEAD"])
+    upstream = _upstream()
+    amend = bool(head) and head == state.get("pending") and not (upstream and _is_ancestor(head, upstream[2]))
+    _run_git(["commit", "--amend", "--no-edit"] if amend else ["commit", "-m", message], capture_output=True)
+    state["pending"] = _git_out(["rev-parse", "HEAD"])
+    state["coalesced"] = state.get("coalesced", 0) + 1 if amend else 1
+    write_json(_sync_state_path(), state)
+    return True
+
+
+def sync(branch: str | None = None) -> int:
+    """Pull (if the upstream moved), rebase queued commits onto it and push them.
+
+    Returns the number of commits pushed.
+    """
+    pull_if_moved()
+    upstream = _upstream()
+    ahead = 1
+    if upstream is not None:
+        ahead = int(_git_out(["rev-list", "--count", f"{upstream[2]}..HEAD"]) or 0)
+    if ahead:
+        _push(branch)
+    write_json(_sync_state_path(), {"last_sync": time.time()})
+    return ahead
+
+
+def sync_due(interval: int) -> bool:
+    """True if interval seconds (> 0) have passed since the last sync."""
+    if interval <= 0:
+        return False
+    return time.time() - float(_load_sync_state().get("last_sync", 0)) >= interval
+
+
 def require_clean_worktree() -> None:
     status = _run_git(["status", "--porcelain"], capture_output=True).stdout.strip()
     if status:
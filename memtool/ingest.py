@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import subprocess
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+
+from . import tracing
+from .chunking import chunk_spans
+from .secret_scrubber import EXCLUDED_PATTERNS, is_excluded_dir, is_excluded_path, mask_with_count, mostly_masked_count
+from .utils import path_str
+
+# Files in flight per worker process between the read and embed stages.
+QUEUE_PER_PROCESS = 4
+
+
+@dataclass
+class FileJob:
+    path: str
+    rel: str
+    size: int
+    mtime_ns: int
+    known_sha256: Optional[str]
+
+
+@dataclass
+class PreparedFile:
+    job: FileJob
+    sha256: str
+    # (chunk id, masked text, token count)
+    chunks: List[Tuple[str, str, int]] = field(default_factory=list)
+    unchanged: bool = False
+    mostly_masked: bool = False
+
+
+@dataclass
+class IngestStats:
+    unchanged: int = 0
+    changed: int = 0
+    chunks: int = 0
+    seen: set = field(default_factory=set)
+
+
+# Excluded directories (node_modules/**, ...) left out by git itself.
+_GIT_PRUNE = [f":(exclude,glob)**/{p}" for p in EXCLUDED_PATTERNS if p.endswith("/**")]
+
+
+def git_files(root: Path) -> Optional[List[Path]]:
+    """Tracked and untracked-but-not-ignored files under root, or None outside git."""
+    tracing.count("subprocesses")
+    with tracing.span("git", command="ls-files") as s:
+        try:
+            out = subprocess.run(
+                ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard", "--", str(root), *_GIT_PRUNE],
+                capture_output=True,
+                check=True,
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        # --cached also lists tracked files deleted from the work tree.
+        files = [Path(p) for p in os.fsdecode(out).split("\0") if p and os.path.isfile(p)]
+        s.set(files=len(files))
+        return files
+
+
+def scan_tree(root: Path) -> Iterator[Path]:
+    """os.scandir walk that never descends into excluded directories or .git."""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = sorted(os.scandir(current), key=lambda e: e.name)
+        except OSError as exc:
+            click.echo(f"Skipping unreadable directory: {path_str(current)} ({exc.strerror})")
+            continue
+        dirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                sub = current / entry.name
+                if entry.name == ".git":
+                    continue
+                if is_excluded_dir(sub):
+                    click.echo(f"Excluded by policy: {path_str(sub)}/")
+                    continue
+                dirs.append(sub)
+            elif entry.is_file():
+                yield current / entry.name
+        stack.extend(reversed(dirs))
+
+
+def walk(paths: Iterable[Path], use_git: bool = True) -> Iterator[Path]:
+    """Yield files under paths.
+
+    Inside a git work tree `git ls-files` lists them, honouring .gitignore;
+    otherwise the tree is scanned with excluded directories pruned.
+    """
+    for p in paths:
+        if p.is_dir():
+            if is_excluded_dir(p):
+                click.echo(f"Excluded by policy: {path_str(p)}/")
+                continue
+            files = git_files(p) if use_git else None
+            yield from files if files is not None else scan_tree(p)
+        elif p.is_file():
+            yield p
+        else:
+            click.echo(f"Skipping missing path: {path_str(p)}")
+
+
+def filter_excluded(files: Iterable[Path]) -> Iterator[Path]:
+    for f in files:
+        if is_excluded_path(f):
+            click.echo(f"Excluded by policy: {path_str(f)}")
+            continue
+        yield f
+
+
+def plan(files: Iterable[Path], manifest: Dict[str, Dict[str, Any]], model: str, stats: IngestStats) -> Iterator[FileJob]:
+    """Skip files whose size and mtime match the manifest; yield the rest."""
+    for f in files:
+        rel = path_str(f)
+        stats.seen.add(rel)
+        st = f.stat()
+        entry = manifest.get(rel)
+        same_model = bool(entry) and entry.get("model") == model
+        if same_model and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            stats.unchanged += 1
+            continue
+        yield FileJob(str(f), rel, st.st_size, st.st_mtime_ns, entry.get("sha256") if same_model else None)
+
+
+def prepare_file(job: FileJob, chunk_size: int, overlap: int) -> PreparedFile:
+    """Read, hash, mask and chunk one file. Runs in a worker process."""
+    raw = Path(job.path).read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest == job.known_sha256:
+        return PreparedFile(job, digest, unchanged=True)
+    text = raw.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+    del raw
+    masked, masked_chars = mask_with_count(text)
+    if mostly_masked_count(len(text), masked_chars):
+        return PreparedFile(job, digest, mostly_masked=True)
+    chunks = []
+    for idx, span in enumerate(chunk_spans(masked, chunk_size=chunk_size, overlap=overlap)):
+        star_ratio = span.text.count("*") / max(1, len(span.text))
+        if star_ratio >= 0.6:
+            continue
+        chunks.append((f"{job.rel}:{idx}", span.text, span.tokens))
+    return PreparedFile(job, digest, chunks)
+
+
+def _prepare_star(args: Tuple[FileJob, int, int]) -> PreparedFile:
+    return prepare_file(*args)
+
+
+def prepare_all(jobs: Iterable[FileJob], chunk_size: int, overlap: int, processes: int) -> Iterator[PreparedFile]:
+    """Run prepare_file over jobs in order with a bounded number in flight.
+
+    The process pool is only started once there is work, so an unchanged tree
+    never pays its startup cost. processes <= 1 runs inline.
+    """
+    if processes <= 1:
+        for job in jobs:
+            yield prepare_file(job, chunk_size, overlap)
+        return
+    pool: Optional[Executor] = None
+    pending: Deque[Any] = deque()
+    limit = processes * QUEUE_PER_PROCESS
+    try:
+        for job in jobs:
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=processes)
+            pending.append(pool.submit(_prepare_star, (job, chunk_size, overlap)))
+            if len(pending) >= limit:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        if pool is not None:
+            for fut in pending:
+                fut.cancel()
+            pool.shutdown(wait=True)
+
+
+def embed_stream(
+    prepared: Iterable[PreparedFile],
+    embed: Callable[[List[str], List[int]], List[List[float]]],
+    window_items: int,
+    window_tokens: int,
+) -> Iterator[Tuple[PreparedFile, List[List[float]]]]:
+    """Group prepared files into windows, embed each window, yield per-file vectors.
+
+    Only one window of chunk text is held at a time; the preceding stages keep
+    reading and chunking ahead while a window is being embedded.
+    """
+    window: List[PreparedFile] = []
+    items = tokens = 0
+
+    def flush() -> Iterator[Tuple[PreparedFile, List[List[float]]]]:
+        texts = [text for pf in window for _, text, _ in pf.chunks]
+        counts = [n for pf in window for _, _, n in pf.chunks]
+        vectors = embed(texts, counts) if texts else []
+        pos = 0
+        for pf in window:
+            yield pf, vectors[pos:pos + len(pf.chunks)]
+            pos += len(pf.chunks)
+
+    for pf in prepared:
+        window.append(pf)
+        items += len(pf.chunks)
+        tokens += sum(n for _, _, n in pf.chunks)
+        if items >= window_items or tokens >= window_tokens:
+            yield from flush()
+            window, items, tokens = [], 0, 0
+    if window:
+        yield from flush()
+
+
+def default_processes() -> int:
+    return max(1, (os.cpu_count() or 1) - 1)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+JOURNAL_SUFFIX = ".messages.jsonl"
+JOURNAL_VERSION = 2
+# Bytes read per step when scanning the journal backwards for recent messages.
+TAIL_BLOCK = 64 * 1024
+
+
+def journal_path(memory_file: Path) -> Path:
+    return memory_file.with_name(memory_file.stem + JOURNAL_SUFFIX)
+
+
+def _line(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=True, separators=(",", ":")) + "\n"
+
+
+def _parse(lines: List[bytes]) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for line in lines:
+        try:
+            out.append(json.loads(line))
+        except json.JSONDecodeError:
+            # A crash mid-append can leave a torn line; it is skipped.
+            continue
+    return out
+
+
+def read_journal(path: Path) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Return (header, messages). A missing or headerless file yields ({}, [])."""
+    if not path.exists():
+        return {}, []
+    with path.open("rb") as fh:
+        try:
+            header = json.loads(fh.readline())
+        except json.JSONDecodeError:
+            return {}, []
+        return header, _parse(fh.readlines())
+
+
+def read_tail(path: Path, n: int) -> List[Dict[str, Any]]:
+    """The last n messages, read backwards from the end of the journal."""
+    if n <= 0 or not path.exists():
+        return []
+    with path.open("rb") as fh:
+        end = fh.seek(0, os.SEEK_END)
+        pos, data = end, b""
+        while pos > 0 and data.count(b"\n") <= n + 1:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            fh.seek(pos)
+            data = fh.read(step) + data
+    # The first piece is either the header or a line cut by the last seek.
+    lines = data.split(b"\n")[1:]
+    return _parse([line for line in lines if line.strip()][-n:])
+
+
+class Journal:
+    """Append-only JSONL log holding a domain's messages.
+
+    New messages are appended; when earlier messages change (summarization
+    drops them) the file is rewritten through a temp file and rename.
+    """
+
+    def __init__(self, path: Path, messages: List[Dict[str, Any]], valid: bool) -> None:
+        self.path = path
+        self.valid = valid
+        self._mark(messages)
+
+    def _mark(self, messages: List[Dict[str, Any]]) -> None:
+        self.persisted = len(messages)
+        self.last = messages[-1] if messages else None
+
+    def can_append(self, messages: List[Dict[str, Any]]) -> bool:
+        """True if the only change since the last write is messages added at the end."""
+        n = self.persisted
+        return self.valid and len(messages) >= n and not (n and messages[n - 1] is not self.last)
+
+    def append(self, messages: List[Dict[str, Any]]) -> int:
+        """Write messages past the persisted prefix; return the bytes written."""
+        new = messages[self.persisted:]
+        if not new:
+            return 0
+        payload = "".join(_line(m) for m in new).encode("utf-8")
+        with self.path.open("ab+") as fh:
+            end = fh.seek(0, os.SEEK_END)
+            if end:
+                fh.seek(end - 1)
+                if fh.read(1) != b"\n":
+                    # An earlier append was torn by a crash; start on a fresh line.
+                    payload = b"\n" + payload
+            fh.write(payload)
+        self._mark(messages)
+        return len(payload)
+
+    def rewrite(self, messages: List[Dict[str, Any]]) -> None:
+        payload = _line({"version": JOURNAL_VERSION}) + "".join(_line(m) for m in messages)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_bytes(payload.encode("utf-8"))
+        os.replace(tmp, self.path)
+        self.valid = True
+        self._mark(messages)
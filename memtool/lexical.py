@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+LEXICAL_SUFFIX = ".lexical.json"
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# Rebuild postings once this share of doc slots are tombstones.
+COMPACT_RATIO = 0.25
+
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased identifier tokens, plus camelCase/snake_case parts.
+
+    `ProfileShare` yields profileshare, profile, share so both exact identifiers
+    and their parts match.
+    """
+    out: List[str] = []
+    for word in _WORD.findall(text):
+        lower = word.lower()
+        out.append(lower)
+        parts = [p.lower() for piece in word.split("_") for p in _CAMEL.findall(piece)]
+        if len(parts) > 1:
+            out.extend(p for p in parts if p != lower)
+    return out
+
+
+def lexical_path(memory_file: Path) -> Path:
+    return memory_file.with_name(memory_file.stem + LEXICAL_SUFFIX)
+
+
+class BM25Index:
+    """Inverted index over docs_index chunks.
+
+    Each chunk gets a stable doc number; postings are flat [doc, tf, doc, tf, ...]
+    int lists. Removed chunks leave a tombstone until the index is compacted.
+    """
+
+    def __init__(self, docs: List[Optional[str]], lengths: List[int], postings: Dict[str, List[int]]) -> None:
+        self.docs = docs
+        self.lengths = lengths
+        self.postings = postings
+        self.live = sum(1 for d in docs if d is not None)
+        self.total_len = sum(n for d, n in zip(docs, lengths) if d is not None)
+        self.dirty = False
+        self._doc_of = {cid: i for i, cid in enumerate(docs) if cid is not None}
+
+    @classmethod
+    def build(cls, chunks: Iterable[Dict[str, Any]]) -> "BM25Index":
+        index = cls([], [], {})
+        index.add(chunks)
+        return index
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "BM25Index":
+        return cls(data["docs"], data["lengths"], data["postings"])
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"docs": self.docs, "lengths": self.lengths, "postings": self.postings}
+
+    def add(self, chunks: Iterable[Dict[str, Any]]) -> None:
+        # The last chunk given for an id wins.
+        chunks = list({ch.get("id"): ch for ch in chunks}.values())
+        # A chunk id added again replaces its doc; the old text is not at
+        # hand, so those docs are dropped from every posting list at once.
+        replaced = {self._doc_of[ch.get("id")] for ch in chunks if ch.get("id") in self._doc_of}
+        for doc in replaced:
+            self._forget(doc)
+        if replaced:
+            self._drop(replaced, list(self.postings))
+        for ch in chunks:
+            cid = ch.get("id")
+            terms = Counter(tokenize(ch.get("text", "")))
+            doc = len(self.docs)
+            self.docs.append(cid)
+            length = sum(terms.values())
+            self.lengths.append(length)
+            self._doc_of[cid] = doc
+            self.live += 1
+            self.total_len += length
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).extend((doc, tf))
+            self.dirty = True
+
+    def remove(self, chunks: Iterable[Dict[str, Any]]) -> None:
+        """Tombstone the chunks' docs, filtering each affected posting list once."""
+        removed: Set[int] = set()
+        terms: Set[str] = set()
+        for ch in chunks:
+            doc = self._doc_of.get(ch.get("id"))
+            if doc is None:
+                continue
+            removed.add(doc)
+            terms.update(tokenize(ch.get("text", "")))
+            self._forget(doc)
+        if removed:
+            self._drop(removed, terms)
+
+    def _forget(self, doc: int) -> None:
+        del self._doc_of[self.docs[doc]]
+        self.docs[doc] = None
+        self.live -= 1
+        self.total_len -= self.lengths[doc]
+        self.lengths[doc] = 0
+        self.dirty = True
+
+    def _drop(self, docs: Set[int], terms: Iterable[str]) -> None:
+        for term in terms:
+            flat = self.postings.get(term)
+            if not flat:
+                continue
+            kept = [v for i in range(0, len(flat), 2) if flat[i] not in docs for v in (flat[i], flat[i + 1])]
+            if len(kept) == len(flat):
+                continue
+            if kept:
+                self.postings[term] = kept
+            else:
+                del self.postings[term]
+
+    def needs_compaction(self) -> bool:
+        return bool(self.docs) and (len(self.docs) - self.live) / len(self.docs) > COMPACT_RATIO
+
+    def search(self, query: str, k: int) -> List[Tuple[float, str]]:
+        """Return up to k (score, chunk id) pairs, best first."""
+        if not self.live or k <= 0:
+            return []
+        avg_len = self.total_len / self.live or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            flat = self.postings.get(term)
+            if not flat:
+                continue
+            df = len(flat) // 2
+            idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+            for i in range(0, len(flat), 2):
+                doc, tf = flat[i], flat[i + 1]
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / avg_len)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(score, self.docs[doc]) for doc, score in top]
+
+
+def get_lexical(docs_index: Dict[str, Any]) -> BM25Index:
+    """Return the domain's BM25 index, loading or building it on first use."""
+    index = docs_index.get("_lexical")
+    if index is not None:
+        return index
+    path = docs_index.get("_lexical_path")
+    chunks = docs_index.get("chunks", [])
+    meta = docs_index.get("lexical", {})
+    index = None
+    if path is not None and path.exists() and meta.get("count") == len(chunks):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        # A file from another commit than docs_index (e.g. taken by a merge) is rebuilt.
+        if data.get("digest") == meta.get("digest"):
+            index = BM25Index.from_json(data)
+    if index is None:
+        index = BM25Index.build(chunks)
+    docs_index["_lexical"] = index
+    return index
+
+
+def attach_lexical(docs_index: Dict[str, Any], memory_file: Path) -> None:
+    docs_index["_lexical_path"] = lexical_path(memory_file)
+
+
+def store_lexical(docs_index: Dict[str, Any], memory_file: Path, digest: str) -> None:
+    """Save the index if it changed; digest is that of the chunks it is saved with."""
+    index: Optional[BM25Index] = docs_index.get("_lexical")
+    if index is None:
+        return
+    if index.needs_compaction():
+        index = BM25Index.build(docs_index.get("chunks", []))
+        docs_index["_lexical"] = index
+    if index.dirty:
+        path = lexical_path(memory_file)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps({**index.to_json(), "digest": digest}, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, path)
+        index.dirty = False
+    else:
+        digest = docs_index.get("lexical", {}).get("digest", "")
+    docs_index["lexical"] = {"file": lexical_path(memory_file).name, "count": index.live, "terms": len(index.postings)}
+    if digest:
+        docs_index["lexical"]["digest"] = digest
+
+
+def rrf_fuse(rankings: Sequence[Sequence[int]], k: int, rrf_k: int = RRF_K) -> List[int]:
+    """Reciprocal-rank fusion of several best-first row rankings."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return [row for row, _ in sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]]
@@ -1,12 +1,22 @@
 from __future__ import annotations
 
+import copy
+import hashlib
+from collections.abc import MutableMapping
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Iterator, List
 
 import click
 
+from . import tracing
 from .config import repo_root
-from .utils import read_json, write_json, ensure_parent, path_str
+from .ann import attach_ann, store_ann
+from .embedders import embedder_name
+from .embedding_store import attach_vectors, store_vectors
+from .journal import JOURNAL_VERSION, Journal, journal_path, read_journal, read_tail
+from .lexical import attach_lexical, store_lexical
+from .token_budget import count_tokens, message_tokens, tokenizer_id
+from .utils import chunks_digest, read_json, write_json, write_text, ensure_parent, path_str
 
 MEMORY_FILES = {
     "global": repo_root() / "project_memory" / "project_memory.json",
@@ -17,6 +27,7 @@ MEMORY_FILES = {
 
 DEFAULT_MEMORY: Dict[str, Any] = {
     "long_term_memory": "",
+    "summaries": [],
     "messages": [],
     "docs_index": {
         "embedding_model": "text-embedding-3-small",
@@ -24,6 +35,14 @@ DEFAULT_MEMORY: Dict[str, Any] = {
     },
 }
 
+FORMAT_VERSION = 2
+SECTIONS = ("messages", "long_term_memory", "summaries", "docs_index")
+LONG_TERM_SUFFIX = ".long_term.md"
+SUMMARIES_SUFFIX = ".summaries.jsonl"
+DOCS_SUFFIX = ".docs.json"
+# JSONL sections and the runtime key holding each one's Journal.
+JOURNALS = {"messages": "_journal", "summaries": "_summaries_journal"}
+
 
 def memory_path(domain: str) -> Path:
     if domain not in MEMORY_FILES:
@@ -31,29 +50,268 @@ def memory_path(domain: str) -> Path:
     return MEMORY_FILES[domain]
 
 
-def load_memory(domain: str) -> Dict[str, Any]:
-    path = memory_path(domain)
-    data = read_json(path, DEFAULT_MEMORY)
-    # Ensure required keys
-    for key, value in DEFAULT_MEMORY.items():
-        if key not in data:
-            data[key] = value
-    if "docs_index" not in data or not isinstance(data["docs_index"], dict):
-        data["docs_index"] = DEFAULT_MEMORY["docs_index"]
-    if "chunks" not in data["docs_index"]:
-        data["docs_index"]["chunks"] = []
-    return data
+def section_paths(memory_file: Path) -> Dict[str, Path]:
+    return {
+        "messages": journal_path(memory_file),
+        "long_term_memory": memory_file.with_name(memory_file.stem + LONG_TERM_SUFFIX),
+        "summaries": memory_file.with_name(memory_file.stem + SUMMARIES_SUFFIX),
+        "docs_index": memory_file.with_name(memory_file.stem + DOCS_SUFFIX),
+    }
+
+
+def _empty_header() -> Dict[str, Any]:
+    return {"format": FORMAT_VERSION, "stats": {}, "sections": {}}
+
+
+def _file_meta(path: Path) -> Dict[str, Any]:
+    return {"file": path.name, "bytes": path.stat().st_size if path.exists() else 0}
+
+
+class MemoryDoc(MutableMapping):
+    """A domain's memory whose sections are read from their own files on first access.
+
+    The memory file itself is a small header with the running stats and, per
+    section, its file name, size and summary counts. messages,
+    long_term_memory, summaries and docs_index load only when a command reads
+    them.
+    """
+
+    def __init__(self, path: Path, header: Dict[str, Any], sections: Dict[str, Any] | None = None) -> None:
+        self.path = path
+        self.header = header
+        self.paths = section_paths(path)
+        self.migrated = sections is not None
+        self._data: Dict[str, Any] = {"stats": dict(header.get("stats") or {})}
+        self._pristine: Dict[str, Any] = {}
+        if sections is not None:
+            for key, value in sections.items():
+                self._attach(key, value)
+            for key, runtime in JOURNALS.items():
+                self._data[runtime] = Journal(self.paths[key], [], False)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._data and key in SECTIONS:
+            self._load(key)
+        return self._data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._data[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(dict.fromkeys([*SECTIONS, *self._data]))
+
+    def __len__(self) -> int:
+        return len(set(SECTIONS) | set(self._data))
+
+    def __contains__(self, key: object) -> bool:
+        return key in SECTIONS or key in self._data
+
+    def loaded(self, key: str) -> bool:
+        return key in self._data
+
+    def fresh(self, key: str) -> bool:
+        """True if the section is unloaded and its file is the one the header describes."""
+        if key in self._data:
+            return False
+        meta = self.header.get("sections", {}).get(key)
+        return meta is not None and _file_meta(self.paths[key])["bytes"] == meta.get("bytes")
+
+    def changed(self, key: str) -> bool:
+        return self._data.get(key) != self._pristine.get(key)
+
+    def mark_saved(self, key: str) -> None:
+        self._pristine[key] = self._data.get(key)
+
+    def _load(self, key: str) -> None:
+        path = self.paths[key]
+        with tracing.span("memory.load", file=path.name) as s:
+            self._read(key, path)
+            if tracing.enabled():
+                s.set(bytes=path.stat().st_size if path.exists() else 0)
+
+    def _read(self, key: str, path: Path) -> None:
+        if key in JOURNALS:
+            header, records = read_journal(path)
+            self._data[key] = records
+            self._data[JOURNALS[key]] = Journal(path, records, header.get("version") == JOURNAL_VERSION)
+        elif key == "long_term_memory":
+            self._attach(key, path.read_text(encoding="utf-8") if path.exists() else "")
+        else:
+            self._attach(key, read_json(path, copy.deepcopy(DEFAULT_MEMORY["docs_index"])))
+
+    def _attach(self, key: str, value: Any) -> None:
+        if key == "docs_index":
+            if not isinstance(value, dict):
+                value = copy.deepcopy(DEFAULT_MEMORY["docs_index"])
+            value.setdefault("chunks", [])
+            attach_vectors(value, self.path)
+            attach_ann(value, self.path, len(value["chunks"]))
+            attach_lexical(value, self.path)
+        elif key == "long_term_memory":
+            self._pristine[key] = value
+        self._data[key] = value
+
+
+def _migrate(path: Path, data: Dict[str, Any]) -> MemoryDoc:
+    """Wrap a single-document memory file (with any journal appended to it)."""
+    sections = {key: data.get(key, copy.deepcopy(DEFAULT_MEMORY[key])) for key in SECTIONS}
+    generation = int((data.get("journal") or {}).get("generation", 0))
+    header, appended = read_journal(journal_path(path))
+    if appended and header.get("generation") == generation:
+        sections["messages"] = list(sections["messages"]) + appended
+    return MemoryDoc(path, {"format": FORMAT_VERSION, "stats": data.get("stats") or {}, "sections": {}}, sections)
+
 
+def load_memory(domain: str) -> MemoryDoc:
+    return load_memory_file(memory_path(domain))
 
-def save_memory(domain: str, memory: Dict[str, Any]) -> Path:
-    path = memory_path(domain)
+
+def load_memory_file(path: Path) -> MemoryDoc:
+    with tracing.span("memory.load", file=path.name) as s:
+        data = read_json(path, None)
+        if tracing.enabled():
+            s.set(bytes=path.stat().st_size if path.exists() else 0)
+    if not isinstance(data, dict):
+        return MemoryDoc(path, _empty_header())
+    if data.get("format") != FORMAT_VERSION:
+        return _migrate(path, data)
+    return MemoryDoc(path, data)
+
+
+def recent_messages(memory: Dict[str, Any], n: int) -> List[Dict[str, Any]]:
+    """The last n messages, read from the end of the journal if they are not loaded."""
+    if isinstance(memory, MemoryDoc) and not memory.loaded("messages"):
+        return read_tail(memory.paths["messages"], n)
+    return memory.get("messages", [])[-n:] if n > 0 else []
+
+
+def index_summary(memory: Dict[str, Any]) -> Dict[str, Any]:
+    """Chunk and file counts of docs_index, from the header when it is not loaded."""
+    if isinstance(memory, MemoryDoc) and not memory.loaded("docs_index"):
+        meta = memory.header.get("sections", {}).get("docs_index", {})
+    else:
+        idx = memory.get("docs_index", {})
+        meta = {"chunks": len(idx.get("chunks", [])), "files": len(idx.get("files", {})), "embedding_model": idx.get("embedding_model")}
+    model = meta.get("embedding_model")
+    return {"chunks": meta.get("chunks", 0), "files": meta.get("files", 0), "embedding_model": model, "embedder": embedder_name(model)}
+
+
+def _index_dirty(idx: Dict[str, Any]) -> bool:
+    if idx.get("_dirty"):
+        return True
+    return any(getattr(idx.get(key), "dirty", False) for key in ("_matrix", "_ann", "_lexical"))
+
+
+def save_memory(domain: str, memory: MemoryDoc, compact: bool = False) -> Path:
+    memory_path(domain)
+    return save_memory_file(memory, compact)
+
+
+def save_memory_file(memory: MemoryDoc, compact: bool = False) -> Path:
+    """Write the sections that were loaded and changed, then the header.
+
+    New messages are appended to the journal; it is rewritten only when
+    earlier messages changed, on migration, or with compact=True. Sections
+    that were never loaded are left untouched.
+    """
+    with tracing.span("memory.save", file=memory.path.name) as s:
+        path = _save(memory, compact)
+        s.set(bytes=sum(meta.get("bytes", 0) for meta in memory.header["sections"].values()))
+        return path
+
+
+def _save(memory: MemoryDoc, compact: bool) -> Path:
+    path = memory.path
     ensure_parent(path)
-    write_json(path, memory)
+    paths = memory.paths
+    sections = memory.header.setdefault("sections", {})
+    rewrite = compact or memory.migrated
+
+    if memory.loaded("long_term_memory"):
+        if rewrite or memory.changed("long_term_memory") or not paths["long_term_memory"].exists():
+            write_text(paths["long_term_memory"], memory["long_term_memory"])
+            memory.mark_saved("long_term_memory")
+        sections["long_term_memory"] = _file_meta(paths["long_term_memory"])
+
+    for key, runtime in JOURNALS.items():
+        if not memory.loaded(key) or not (memory[key] or paths[key].exists()):
+            continue
+        records = memory[key]
+        journal = memory.get(runtime) or Journal(paths[key], [], False)
+        if rewrite or not journal.can_append(records):
+            journal.rewrite(records)
+        else:
+            journal.append(records)
+        memory[runtime] = journal
+        sections[key] = {**_file_meta(paths[key]), "count": len(records)}
+
+    if memory.loaded("docs_index"):
+        idx = memory["docs_index"]
+        if rewrite or _index_dirty(idx) or not paths["docs_index"].exists():
+            digest = chunks_digest(idx["chunks"])
+            store_vectors(idx, path, digest)
+            store_ann(idx, path, digest)
+            store_lexical(idx, path, digest)
+            idx.pop("_dirty", None)
+            write_json(paths["docs_index"], {k: v for k, v in idx.items() if not k.startswith("_")})
+        sections["docs_index"] = {**_file_meta(paths["docs_index"]), **index_summary(memory)}
+
+    header = {"format": FORMAT_VERSION, "stats": memory_stats(memory), "sections": sections}
+    if rewrite or header != read_json(path, None):
+        write_json(path, header)
+    memory.header = copy.deepcopy(header)
+    memory.migrated = False
     return path
 
 
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def memory_stats(memory: Dict[str, Any]) -> Dict[str, Any]:
+    """Running token totals kept in memory["stats"].
+
+    Totals are trusted while the tokenizer, message count and long-term digest
+    still match, or, for sections not loaded, while their files are the ones the
+    header describes; otherwise they are rebuilt from the per-message counts.
+    """
+    stats = memory.get("stats") or {}
+    tokenizer = tokenizer_id()
+    fresh = memory.fresh if isinstance(memory, MemoryDoc) else (lambda key: False)
+    if stats.get("tokenizer") != tokenizer or not (
+        fresh("messages") or stats.get("message_count") == len(memory.get("messages", []))
+    ):
+        messages = memory.get("messages", [])
+        stats = {
+            "tokenizer": tokenizer,
+            "message_count": len(messages),
+            "message_tokens": sum(message_tokens(m) for m in messages),
+        }
+    if not (fresh("long_term_memory") and "long_term_tokens" in stats):
+        long_term = memory.get("long_term_memory", "")
+        digest = _digest(long_term)
+        if stats.get("long_term_digest") != digest or "long_term_tokens" not in stats:
+            stats["long_term_digest"] = digest
+            stats["long_term_tokens"] = count_tokens(long_term) if long_term else 0
+    memory["stats"] = stats
+    return stats
+
+
+def append_messages(memory: Dict[str, Any], messages: Iterable[Dict[str, Any]]) -> None:
+    """Append messages, counting each once and updating the running totals."""
+    stats = memory_stats(memory)
+    history = memory.setdefault("messages", [])
+    for m in messages:
+        stats["message_tokens"] += message_tokens(m)
+        history.append(m)
+    stats["message_count"] = len(history)
+
+
 def ensure_memory_files() -> None:
     for path in MEMORY_FILES.values():
         ensure_parent(path)
         if not path.exists():
-            write_json(path, DEFAULT_MEMORY)
+            write_json(path, _empty_header())
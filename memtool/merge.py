@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import json
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .journal import JOURNAL_SUFFIX, JOURNAL_VERSION, read_journal
+from .memory_store import SUMMARIES_SUFFIX
+
+# Sidecars are row-aligned with docs_index chunks and cannot be combined, so
+# they follow whichever side the merged index is taken from (ours).
+OURS_SUFFIXES = (".f32", ".i32", ".lexical.json")
+
+
+def _key(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    """What identifies a message (or summary section); the token count stamps are left out."""
+    if "role" in record or "content" in record:
+        return ("message", record.get("role"), record.get("content"), bool(record.get("pinned")))
+    return ("section", record.get("level"), record.get("text"), record.get("messages"), record.get("created"))
+
+
+def _edits(base: List[Tuple[Any, ...]], side: List[Tuple[Any, ...]]) -> Tuple[List[Optional[int]], List[List[int]]]:
+    """How side changed base, record by record.
+
+    Returns the side index each base record was kept at (None if dropped) and
+    the side indices inserted before each base position; the last list holds
+    what was appended.
+    """
+    kept: List[Optional[int]] = [None] * len(base)
+    inserted: List[List[int]] = [[] for _ in range(len(base) + 1)]
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, base, side, autojunk=False).get_opcodes():
+        if tag == "equal":
+            kept[i1:i2] = range(j1, j2)
+        else:
+            inserted[i1].extend(range(j1, j2))
+    return kept, inserted
+
+
+def merge_messages(base: List[Dict[str, Any]], ours: List[Dict[str, Any]], theirs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ours, minus what theirs dropped from base (summarized), plus what theirs added.
+
+    Records are matched by position as well as content, so repeated messages
+    stay and each side's additions keep their place; where both sides added at
+    the same point, ours come first.
+    """
+    base_keys = [_key(m) for m in base]
+    ours_kept, ours_added = _edits(base_keys, [_key(m) for m in ours])
+    theirs_kept, theirs_added = _edits(base_keys, [_key(m) for m in theirs])
+    merged: List[Dict[str, Any]] = []
+    for i in range(len(base) + 1):
+        merged.extend(ours[j] for j in ours_added[i])
+        merged.extend(theirs[j] for j in theirs_added[i])
+        if i < len(base):
+            o, t = ours_kept[i], theirs_kept[i]
+            if o is not None and t is not None:
+                merged.append(ours[o])
+    return merged
+
+
+def merge_long_term(base: str, ours: str, theirs: str) -> str:
+    if ours == base:
+        return theirs
+    if theirs in (base, ours):
+        return ours
+    seen = {p.strip() for p in ours.split("\n\n")}
+    extra = [p.strip() for p in theirs.split("\n\n") if p.strip() and p.strip() not in seen]
+    return "\n\n".join([ours.strip(), *extra]).strip()
+
+
+def merge_docs(base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep our chunks and vectors, dropping manifest entries for files theirs re-indexed.
+
+    The next index-files run then sees those files as new and embeds them again.
+    """
+    base_files = base.get("files", {})
+    theirs_files = theirs.get("files", {})
+    files = ours.get("files", {})
+    for rel, entry in theirs_files.items():
+        if base_files.get(rel) != entry and files.get(rel) != entry:
+            files.pop(rel, None)
+    ours["files"] = files
+    return ours
+
+
+def _read_text(path: Path) -> str:
+    return path.read_text(encoding="utf-8") if path.exists() else ""
+
+
+def _read_json(path: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def merge_file(base: Path, ours: Path, theirs: Path, name: str) -> bool:
+    """Three-way merge of one project_memory file into `ours`, as a git merge driver.
+
+    Returns False when the file is not one memtool knows how to merge, so git
+    reports the conflict as usual.
+    """
+    if name.endswith(OURS_SUFFIXES):
+        return True
+    if name.endswith((JOURNAL_SUFFIX, SUMMARIES_SUFFIX)):
+        # Summary sections merge like messages: both sides' additions, minus roll-ups' children.
+        merged = merge_messages(read_journal(base)[1], read_journal(ours)[1], read_journal(theirs)[1])
+        lines = [{"version": JOURNAL_VERSION}, *merged]
+        ours.write_text("".join(json.dumps(m, ensure_ascii=True, separators=(",", ":")) + "\n" for m in lines), encoding="utf-8")
+        return True
+    if name.endswith(".md"):
+        ours.write_text(merge_long_term(_read_text(base), _read_text(ours), _read_text(theirs)), encoding="utf-8")
+        return True
+    if not name.endswith(".json"):
+        return False
+    b, o, t = _read_json(base), _read_json(ours), _read_json(theirs)
+    if not o:
+        return False
+    if "chunks" in o:
+        merged = merge_docs(b, o, t)
+    elif "messages" in o:
+        # Single-document memory file from before the sectioned layout.
+        merged = dict(o)
+        merged["messages"] = merge_messages(b.get("messages", []), o.get("messages", []), t.get("messages", []))
+        merged["long_term_memory"] = merge_long_term(
+            b.get("long_term_memory", ""), o.get("long_term_memory", ""), t.get("long_term_memory", "")
+        )
+        if "docs_index" in o:
+            merged["docs_index"] = merge_docs(b.get("docs_index", {}), o["docs_index"], t.get("docs_index", {}))
+    else:
+        # Section header: its recorded sizes no longer match the merged files,
+        # so the stats are recomputed on the next load.
+        merged = o
+    ours.write_text(json.dumps(merged, indent=2, ensure_ascii=True), encoding="utf-8")
+    return True
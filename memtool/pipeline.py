@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from .config import Settings
+from .embedding_cache import open_cache
+from .memory_store import MemoryDoc, ensure_memory_files, index_summary, load_memory
+from .retrieval import embed_query
+from .utils import Timings
+
+
+def prepare_turn(
+    client: Any,
+    settings: Settings,
+    domain: str,
+    prompt: str,
+    mode: str,
+    pull: Callable[[], None],
+    timings: Timings,
+    concurrent: bool = True,
+    search: Sequence[str] = (),
+) -> Tuple[MemoryDoc, Optional[List[float]]]:
+    """Pull and load the domain and embed the query; return (memory, query embedding).
+
+    The query embedding only needs the prompt, so with concurrent=True it runs
+    on a worker thread while pull -> load runs on this one. It is skipped for
+    lexical retrieval and when neither domain nor any of the other `search`
+    domains has chunks before the pull; retrieval embeds the query itself if
+    chunks arrive with it.
+    Summarization is not part of a turn's preparation: chat runs it after the
+    answer is shown.
+    """
+
+    def prepare() -> MemoryDoc:
+        with timings.phase("pull"):
+            pull()
+        with timings.phase("load"):
+            ensure_memory_files()
+            return load_memory(domain)
+
+    def embed() -> List[float]:
+        # Opened here: sqlite connections stay on the thread that made them.
+        cache = open_cache(settings)
+        try:
+            with timings.phase("embed"):
+                return embed_query(client, settings.embed_model, prompt, cache)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    wanted = mode != "lexical" and any(index_summary(load_memory(d))["chunks"] for d in {domain, *search})
+    if not wanted:
+        return prepare(), None
+    if not concurrent:
+        memory = prepare()
+        return memory, embed()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        query_emb = pool.submit(embed)
+        memory = prepare()
+        return memory, query_emb.result()
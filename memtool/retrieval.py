@@ -1,49 +1,43 @@
 from __future__ import annotations
 
-import json
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterable, List, Dict, Any
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Dict, Any, Tuple
 
 import click
-from openai import OpenAI
 
-from .token_budget import count_tokens, cosine_similarity
-from .secret_scrubber import mask, mostly_masked, is_excluded_path
-from .utils import path_str
+from . import tracing
+from .ann import ANN_MIN_CHUNKS, DEFAULT_NPROBE, update_ann
+from .batching import DEFAULT_BATCH_ITEMS, DEFAULT_BATCH_TOKENS, DEFAULT_WORKERS, embed_batched, load_checkpoint
+from .embedders import embedder_name, get_embedder, require_same_embedder
+from .embedding_cache import EmbeddingCache, embed_cached
+from .embedding_store import EmbeddingMatrix, docs_matrix
+from .lexical import get_lexical, rrf_fuse
+from .memory_store import index_summary
+from .ingest import IngestStats, PreparedFile, default_processes, embed_stream, filter_excluded, plan, prepare_all, walk
+from .vector_index import VectorIndex
 
-
-@dataclass
-class Chunk:
-    id: str
-    text: str
-    embedding: List[float]
-
-
-def chunk_text(text: str, chunk_size: int = 800, overlap: int = 150) -> List[str]:
-    tokens = text.split()
-    chunks: List[str] = []
-    start = 0
-    while start < len(tokens):
-        end = min(len(tokens), start + chunk_size)
-        chunk_tokens = tokens[start:end]
-        if chunk_tokens:
-            chunks.append(" ".join(chunk_tokens))
-        if end == len(tokens):
-            break
-        start = end - overlap
-        if start < 0:
-            start = 0
-    return chunks
+if TYPE_CHECKING:  # pragma: no cover
+    from openai import OpenAI
 
 
 def embed_texts(client: OpenAI, model: str, texts: List[str]) -> List[List[float]]:
     try:
-        resp = client.embeddings.create(model=model, input=texts)
+        with tracing.span("embed.request", model=model, texts=len(texts)):
+            return get_embedder(client, model).embed(texts)
+    except click.ClickException:
+        raise
     except Exception as exc:  # pragma: no cover - network
         raise click.ClickException(f"Embedding failed: {exc}") from exc
-    vectors = [d.embedding for d in resp.data]
-    return vectors
+
+
+def _in_scope(rel: str, roots: List[Path]) -> bool:
+    target = Path(rel).resolve()
+    for root in roots:
+        root = root.resolve()
+        if target == root or root in target.parents:
+            return True
+    return False
 
 
 def index_files(
@@ -54,73 +48,287 @@ def index_files(
     chunk_size: int,
     overlap: int,
     dry_run: bool = False,
+    batch_tokens: int = DEFAULT_BATCH_TOKENS,
+    batch_items: int = DEFAULT_BATCH_ITEMS,
+    workers: int = DEFAULT_WORKERS,
+    checkpoint: Path | None = None,
+    cache: EmbeddingCache | None = None,
+    ann_min_chunks: int = ANN_MIN_CHUNKS,
+    processes: int | None = None,
+    use_git: bool = True,
+    rebuild: bool = False,
 ) -> Dict[str, Any]:
+    """Incrementally index files into docs_index.
+
+    docs_index["files"] maps each indexed path to its size, mtime, content hash,
+    chunk ids and embedding model. Unchanged files are skipped, changed files have
+    their chunks replaced and files deleted under the given paths are pruned.
+
+    Files stream through walk -> filter -> read/mask/chunk (process pool) ->
+    embed -> write with bounded buffering, so memory does not grow with the
+    size of the tree being walked.
+
+    The index holds vectors from one embedder (model) only: indexing with
+    another is refused unless rebuild=True, which starts the index afresh (as
+    does finding its vectors file taken from another commit).
+    """
     paths = list(paths)
-    valid_files: List[Path] = []
-    for p in paths:
-        if p.is_dir():
-            for fp in p.rglob("*"):
-                if fp.is_file():
-                    valid_files.append(fp)
-        elif p.is_file():
-            valid_files.append(p)
-        else:
-            click.echo(f"Skipping missing path: {path_str(p)}")
-
-    filtered: List[Path] = []
-    for f in valid_files:
-        if is_excluded_path(f):
-            click.echo(f"Excluded by policy: {path_str(f)}")
-            continue
-        filtered.append(f)
-
-    new_chunks: List[Chunk] = []
-    for f in filtered:
-        text = f.read_text(encoding="utf-8", errors="ignore")
-        masked = mask(text)
-        if mostly_masked(text, masked):
-            click.echo(f"Skipping mostly-masked file: {path_str(f)}")
-            continue
-        pieces = chunk_text(masked, chunk_size=chunk_size, overlap=overlap)
-        for idx, piece in enumerate(pieces):
-            star_ratio = piece.count("*") / max(1, len(piece))
-            if star_ratio >= 0.6:
+    idx = memory.setdefault("docs_index", {"embedding_model": model, "chunks": []})
+    if idx.pop("_stale", None) and not rebuild:
+        click.echo("The docs index's embeddings came from another commit; re-embedding every file.")
+        rebuild = True
+    if rebuild:
+        idx.update({"chunks": [], "files": {}, "_matrix": EmbeddingMatrix(0, dirty=True), "_dirty": True})
+        idx.pop("_lexical", None)
+        idx.pop("_ann", None)
+    elif idx.get("chunks"):
+        require_same_embedder(
+            idx.get("embedding_model"), model, "The docs index", "Re-embed everything with `memtool index-files --rebuild`."
+        )
+    manifest: Dict[str, Dict[str, Any]] = idx.setdefault("files", {})
+    embedder = get_embedder(client, model)
+    stats = IngestStats()
+    refreshed: Dict[str, Dict[str, int]] = {}
+    touched: Dict[str, Dict[str, Any]] = {}
+
+    jobs = plan(filter_excluded(walk(paths, use_git=use_git)), manifest, model, stats)
+    prepared = prepare_all(jobs, chunk_size, overlap, default_processes() if processes is None else processes)
+
+    def changed_files(items: Iterable[PreparedFile]) -> Iterator[PreparedFile]:
+        for pf in items:
+            job = pf.job
+            if pf.unchanged:
+                refreshed[job.rel] = {"size": job.size, "mtime_ns": job.mtime_ns}
+                stats.unchanged += 1
                 continue
-            new_chunks.append(Chunk(id=f"{path_str(f)}:{idx}", text=piece, embedding=[]))
+            if pf.mostly_masked:
+                click.echo(f"Skipping mostly-masked file: {job.rel}")
+            touched[job.rel] = {
+                "size": job.size,
+                "mtime_ns": job.mtime_ns,
+                "sha256": pf.sha256,
+                "chunk_ids": [cid for cid, _, _ in pf.chunks],
+                "model": model,
+            }
+            stats.changed += 1
+            stats.chunks += len(pf.chunks)
+            yield pf
+
+    def deleted_files() -> List[str]:
+        return [rel for rel in manifest if rel not in stats.seen and not Path(rel).exists() and _in_scope(rel, paths)]
 
     if dry_run:
-        click.echo(f"Would index {len(new_chunks)} chunks from {len(filtered)} files.")
+        for _ in changed_files(prepared):
+            pass
+        click.echo(
+            f"Would index {stats.chunks} chunks from {stats.changed} changed files "
+            f"({stats.unchanged} unchanged, {len(deleted_files())} deleted)."
+        )
         return memory
 
-    if not new_chunks:
-        click.echo("No chunks to index.")
+    # Batches finished by an interrupted earlier run; read once, not per window.
+    resume = load_checkpoint(checkpoint) if embedder.remote else {}
+
+    def embed(texts: List[str], counts: List[int]) -> List[List[float]]:
+        with tracing.span("index.embed", texts=len(texts), tokens=sum(counts)):
+            if not embedder.remote:
+                # Local embedding is cheaper than batching, checkpoints or the cache.
+                return embedder.embed(texts)
+            return embed_cached(
+                cache,
+                model,
+                texts,
+                lambda misses: embed_batched(
+                    client,
+                    model,
+                    misses,
+                    max_tokens=batch_tokens,
+                    max_items=batch_items,
+                    workers=workers,
+                    checkpoint=checkpoint,
+                    keep_checkpoint=True,
+                    resume=resume,
+                    token_counts=counts if len(misses) == len(texts) else None,
+                ),
+            )
+
+    # Results are staged and only swapped into docs_index once every file has
+    # been embedded, so a failed run leaves it untouched.
+    staged_chunks: List[Dict[str, str]] = []
+    staged_vectors = EmbeddingMatrix(docs_matrix(idx).dim)
+    for pf, vectors in embed_stream(changed_files(prepared), embed, batch_items * workers, batch_tokens * workers):
+        staged_chunks.extend({"id": cid, "text": text, "tokens": tokens} for cid, text, tokens in pf.chunks)
+        staged_vectors.extend(vectors)
+    deleted = deleted_files()
+
+    for rel, fresh in refreshed.items():
+        manifest[rel].update(fresh)
+    if refreshed:
+        idx["_dirty"] = True
+    if not touched and not deleted:
+        click.echo(f"No changes to index ({stats.unchanged} files unchanged).")
         return memory
+    idx["_dirty"] = True
 
-    embeds = embed_texts(client, model, [c.text for c in new_chunks])
-    for chunk, emb in zip(new_chunks, embeds):
-        chunk.embedding = emb
+    with tracing.span("index.update", added=len(staged_chunks), files=len(touched), deleted=len(deleted)):
+        replaced = set(touched) | set(deleted)
+        stale_ids = {cid for rel in replaced for cid in manifest.get(rel, {}).get("chunk_ids", [])}
+        legacy_prefixes = tuple(f"{rel}:" for rel in replaced if rel not in manifest)
+        keep = [
+            row
+            for row, ch in enumerate(idx["chunks"])
+            if ch.get("id") not in stale_ids and not (legacy_prefixes and ch.get("id", "").startswith(legacy_prefixes))
+        ]
+        matrix = docs_matrix(idx)
+        lexical = get_lexical(idx)
+        if len(keep) != len(idx["chunks"]):
+            kept = set(keep)
+            lexical.remove(ch for row, ch in enumerate(idx["chunks"]) if row not in kept)
+            idx["chunks"] = [idx["chunks"][row] for row in keep]
+            matrix.keep(keep)
+        else:
+            keep = None
 
-    idx = memory.setdefault("docs_index", {"embedding_model": model, "chunks": []})
-    idx["embedding_model"] = model
-    idx["chunks"].extend({"id": c.id, "text": c.text, "embedding": c.embedding} for c in new_chunks)
+        idx["embedding_model"] = model
+        idx["embedder"] = embedder.name
+        idx["chunks"].extend(staged_chunks)
+        lexical.add(staged_chunks)
+        matrix.extend_normalized(staged_vectors)
+        update_ann(idx, matrix, keep, len(staged_chunks), ann_min_chunks)
+        for rel in deleted:
+            del manifest[rel]
+        manifest.update(touched)
+    if checkpoint is not None and checkpoint.exists():
+        checkpoint.unlink()
+    click.echo(
+        f"Indexed {len(staged_chunks)} chunks from {len(touched)} changed files "
+        f"({stats.unchanged} unchanged, {len(deleted)} deleted)."
+    )
     return memory
 
 
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+# Candidates taken from each ranking before reciprocal-rank fusion, per k.
+FUSION_DEPTH = 4
+
+
+def embed_query(client: OpenAI, model: str, query: str, cache: EmbeddingCache | None = None) -> List[float]:
+    if embedder_name(model) == "local":
+        return embed_texts(client, model, [query])[0]
+    return embed_cached(cache, model, [query], lambda texts: embed_texts(client, model, texts))[0]
+
+
+def rank_domain(
+    idx: Dict[str, Any],
+    query: str,
+    query_emb: List[float] | None,
+    depth: int,
+    nprobe: int,
+    mode: str,
+) -> List[List[Tuple[float, int]]]:
+    """Best-first (score, row) rankings of one docs_index, one list per method.
+
+    BM25 scores are divided by the domain's best score so they compare across
+    domains; cosine scores already do.
+    """
+    chunks = idx.get("chunks") or []
+    rankings: List[List[Tuple[float, int]]] = []
+    if mode in ("lexical", "hybrid"):
+        with tracing.span("retrieve.lexical", chunks=len(chunks)):
+            row_of = {ch.get("id"): row for row, ch in enumerate(chunks)}
+            hits = [(score, row_of[cid]) for score, cid in get_lexical(idx).search(query, depth) if cid in row_of]
+            best = hits[0][0] if hits else 1.0
+            rankings.append([(score / best, row) for score, row in hits])
+    if mode in ("vector", "hybrid"):
+        hits = []
+        if query_emb is not None:
+            matrix = docs_matrix(idx)
+            ann = idx.get("_ann")
+            with tracing.span("retrieve.vector", chunks=len(matrix)) as s:
+                if ann is not None and nprobe > 0:
+                    hits = ann.search(matrix.as_numpy(), query_emb, depth, nprobe)
+                    s.set(index="ivf", nprobe=nprobe)
+                else:
+                    hits = VectorIndex.from_matrix(matrix).search(query_emb, depth)
+                    s.set(index="exact")
+        rankings.append(hits)
+    return rankings
+
+
+def retrieve_federated(
+    client: OpenAI,
+    memories: Dict[str, Dict[str, Any]],
+    query: str,
+    model: str,
+    k: int,
+    cache: EmbeddingCache | None = None,
+    nprobe: int = DEFAULT_NPROBE,
+    mode: str = "hybrid",
+    query_emb: List[float] | None = None,
+) -> List[str]:
+    """Return the top-k chunk texts for query across several domains' indexes.
+
+    The query is embedded once and each domain is searched on its own thread
+    (loading its docs_index there if needed). Per method, the domains' hits are
+    merged by score; in hybrid mode the merged rankings are then fused with
+    reciprocal-rank fusion as for a single domain. Vector search is refused
+    for a domain indexed with a different embedding model than the query's.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise click.ClickException(f"Unknown retrieval mode '{mode}' (expected one of {', '.join(RETRIEVAL_MODES)}).")
+    depth = k * FUSION_DEPTH if mode == "hybrid" else k
+    if mode != "lexical":
+        for domain, memory in memories.items():
+            summary = index_summary(memory)
+            if summary["chunks"]:
+                require_same_embedder(
+                    summary["embedding_model"],
+                    model,
+                    f"Domain '{domain}'" if domain else "The docs index",
+                    "Re-index it with `memtool index-files --rebuild`, switch MEMTOOL_EMBEDDER back, or use --mode lexical.",
+                )
+
+    def search(memory: Dict[str, Any]) -> Tuple[Dict[str, Any], List[List[Tuple[float, int]]]]:
+        idx = memory.get("docs_index", {})
+        if not idx.get("chunks"):
+            return idx, []
+        return idx, rank_domain(idx, query, query_emb, depth, nprobe, mode)
+
+    if mode != "lexical" and query_emb is None and any(index_summary(m)["chunks"] for m in memories.values()):
+        query_emb = embed_query(client, model, query, cache)
+    with tracing.span("retrieve.rank", domains=len(memories), mode=mode, depth=depth):
+        if len(memories) == 1:
+            results = [search(m) for m in memories.values()]
+        else:
+            with ThreadPoolExecutor(max_workers=len(memories)) as pool:
+                results = list(pool.map(search, memories.values()))
+
+    merged: List[List[Tuple[float, Tuple[int, int]]]] = []
+    for method in range(2 if mode == "hybrid" else 1):
+        hits = [(score, (d, row)) for d, (_, rankings) in enumerate(results) if rankings for score, row in rankings[method]]
+        merged.append(sorted(hits, key=lambda h: h[0], reverse=True)[:depth])
+    keys = [key for _, key in merged[0][:k]] if len(merged) == 1 else rrf_fuse([[key for _, key in m] for m in merged], k)
+    texts = [results[d][0]["chunks"][row].get("text", "") for d, row in keys]
+    return [text for text in texts if text]
+
+
 def retrieve_chunks(
     client: OpenAI,
     memory: Dict[str, Any],
     query: str,
     model: str,
     k: int,
+    cache: EmbeddingCache | None = None,
+    nprobe: int = DEFAULT_NPROBE,
+    mode: str = "hybrid",
+    query_emb: List[float] | None = None,
 ) -> List[str]:
-    idx = memory.get("docs_index", {})
-    chunks = idx.get("chunks") or []
-    if not chunks:
-        return []
-    query_emb = embed_texts(client, model, [query])[0]
-    scored = []
-    for ch in chunks:
-        score = cosine_similarity(query_emb, ch.get("embedding", []))
-        scored.append((score, ch.get("text", "")))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [text for _, text in scored[:k] if text]
+    """Return the top-k chunk texts for query.
+
+    mode "vector" ranks by embedding similarity, "lexical" by BM25 only (no
+    embedding call), and "hybrid" fuses both rankings with reciprocal-rank
+    fusion. Vector search uses the domain's IVF index when one exists and
+    nprobe > 0; otherwise (or with nprobe 0) it scans every chunk exactly.
+    query_emb skips the embedding call when the caller already has it.
+    """
+    return retrieve_federated(client, {"": memory}, query, model, k, cache, nprobe, mode, query_emb)
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-import fnmatch
+import bisect
+import os
 import re
 from pathlib import Path
-from typing import Iterable
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 MASK = "********"
 
@@ -41,22 +42,237 @@ SECRET_PATTERNS = [
 ]
 
 
+def _glob_regex(pattern: str) -> str:
+    """fnmatch-style glob as a regex in which '*' and '?' never cross '/'."""
+    out: List[str] = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and "]" in pattern[i + 1:]:
+            j = pattern.index("]", i + 1)
+            body = pattern[i:j].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            elif body.startswith("^"):
+                body = "\\" + body
+            out.append(f"[{body}]")
+            i = j + 1
+        else:
+            out.append(re.escape(c))
+    return "".join(out)
+
+
+def compile_exclusions(patterns: Iterable[str]) -> re.Pattern:
+    """One regex that finds an excluded component anywhere in a posix path.
+
+    "name/**" patterns only match directories, so callers test a directory as
+    "path/". Other patterns match a file or directory component.
+    """
+    alts = []
+    for pattern in patterns:
+        if pattern.endswith("/**"):
+            alts.append(_glob_regex(pattern[:-3]) + "/")
+        else:
+            alts.append(_glob_regex(pattern) + r"(?:/|\Z)")
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return re.compile(r"(?:^|/)(?:" + "|".join(alts) + ")", flags)
+
+
+EXCLUDED_MATCHER = compile_exclusions(EXCLUDED_PATTERNS)
+
+
 def is_excluded_path(path: Path) -> bool:
-    path_posix = path.as_posix()
-    parts = list(path.parts)
-    for pattern in EXCLUDED_PATTERNS:
-        if fnmatch.fnmatch(path_posix, pattern):
-            return True
-        if any(fnmatch.fnmatch(part, pattern) for part in parts):
-            return True
-    return False
+    return EXCLUDED_MATCHER.search(path.as_posix()) is not None
+
+
+def is_excluded_dir(path: Path) -> bool:
+    return EXCLUDED_MATCHER.search(path.as_posix() + "/") is not None
+
+
+# Lowercase literals that every match of the pattern contains, keyed by
+# SECRET_PATTERNS position. Candidate offsets are found with str.find over a
+# lowercased copy and the regexes only run there, instead of every pattern
+# being tried at every character. "://" matches begin at the word before it.
+SECRET_ANCHORS = {
+    0: ("sk_live_",),
+    1: ("aiza",),
+    2: ("xox",),
+    3: ("ghp_",),
+    4: ("akia",),
+    5: ("aws_secret_access_key",),
+    6: ("bearer",),
+    7: ("eyj",),
+    8: ("password", "passwd", "pwd", "secret", "token", "apikey", "api_key", "auth"),
+    9: ("://",),
+    10: ("postgres",),
+}
+# Carry-over kept between streamed pieces; secrets longer than this may be split.
+STREAM_WINDOW = 4096
+
+_ASCII_LOWER = {c: c + 32 for c in range(ord("A"), ord("Z") + 1)}
+
+
+def _lower(text: str) -> str:
+    return text.lower() if text.isascii() else text.translate(_ASCII_LOWER)
+
+
+def _word_start(text: str, i: int) -> int:
+    while i > 0 and (text[i - 1].isalnum() or text[i - 1] == "_"):
+        i -= 1
+    return i
+
+
+def _pattern_spans(text: str, lower: str, index: int) -> List[Tuple[int, int]]:
+    """(start, end) of pattern `index` at every start offset where it matches.
+
+    Anchored patterns are only tried where one of their literals occurs;
+    patterns without anchors still work, just with a full regex scan.
+    """
+    pattern = SECRET_PATTERNS[index]
+    literals = SECRET_ANCHORS.get(index)
+    if literals is None:
+        return [m.span() for m in pattern.finditer(text) if m.end() > m.start()]
+    ends: Dict[int, int] = {}
+    for literal in literals:
+        i = lower.find(literal)
+        while i != -1:
+            start = _word_start(text, i) if literal == "://" else i
+            if start not in ends:
+                m = pattern.match(text, start)
+                ends[start] = m.end() if m is not None else start
+            i = lower.find(literal, i + 1)
+    return [(start, end) for start, end in ends.items() if end > start]
+
+
+def _merge(spans: Iterable[Tuple[int, int]], join_adjacent: bool = True) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and (start <= merged[-1][1] if join_adjacent else start < merged[-1][1]):
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _leftmost(spans: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """The non-overlapping matches finditer would pick, given every match there is."""
+    picked: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if not picked or start >= picked[-1][1]:
+            picked.append((start, end))
+    return picked
+
+
+def _unmask(spans: List[Tuple[int, int]], found: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Map spans found in the text masked at `spans` back to offsets in the original text."""
+    starts: List[int] = []
+    shifts: List[int] = []
+    shift = 0
+    for s, e in spans:
+        starts.append(s - shift)
+        shift += (e - s) - len(MASK)
+        shifts.append(shift)
+
+    def original(c: int, end: bool) -> int:
+        i = bisect.bisect_right(starts, c) - 1
+        if i < 0:
+            return c
+        if c < starts[i] + len(MASK):
+            return spans[i][1] - 1 if end else spans[i][0]
+        return c + shifts[i]
+
+    return [(original(s, False), original(e - 1, True) + 1) for s, e in found]
+
+
+def find_secret_spans(text: str) -> List[Tuple[int, int]]:
+    """Sorted, merged (start, end) spans of text to mask.
+
+    Patterns run in SECRET_PATTERNS order, each over the text as one re.sub
+    per pattern would have left it, so the keyword pattern still takes in a
+    whole masked value ("Authorization: Bearer a+b" is "Authorization:
+    ********+b" by then, and becomes one mask). On top of those substitutions
+    every start offset where a pattern matches is masked too, so a match that
+    begins inside another one and runs past it is covered.
+    """
+    # What the substitutions replaced so far, in text offsets; they alone
+    # decide the text later patterns see.
+    masks: List[Tuple[int, int]] = []
+    spans: List[Tuple[int, int]] = []
+    current, lower = text, _lower(text)
+    for index, pattern in enumerate(SECRET_PATTERNS):
+        found = _pattern_spans(current, lower, index)
+        if not found:
+            continue
+        if "://" in SECRET_ANCHORS.get(index, ()):
+            subbed = [m.span() for m in pattern.finditer(current)]
+        else:
+            subbed = _leftmost(found)
+        spans = _merge(spans + _unmask(masks, found + subbed))
+        if subbed:
+            masks = _merge(masks + _unmask(masks, subbed), join_adjacent=False)
+            current = _apply_spans(text, masks)[0]
+            lower = _lower(current)
+    return spans
+
+
+def _apply_spans(text: str, spans: List[Tuple[int, int]], start: int = 0, stop: Optional[int] = None) -> Tuple[str, int]:
+    stop = len(text) if stop is None else stop
+    parts: List[str] = []
+    cursor = start
+    for s, e in spans:
+        parts.append(text[cursor:s])
+        parts.append(MASK)
+        cursor = e
+    parts.append(text[cursor:stop])
+    return "".join(parts), len(MASK) * len(spans)
+
+
+def mask_with_count(text: str) -> Tuple[str, int]:
+    """Mask secrets in one pass; return the masked text and the number of mask characters written."""
+    return _apply_spans(text, find_secret_spans(text))
 
 
 def mask(text: str) -> str:
-    masked = text
-    for pattern in SECRET_PATTERNS:
-        masked = pattern.sub(MASK, masked)
-    return masked
+    return mask_with_count(text)[0]
+
+
+def mask_stream(pieces: Iterable[str], window: int = STREAM_WINDOW) -> Iterator[Tuple[str, int]]:
+    """Mask a text delivered in pieces, yielding (masked text, mask chars) as it goes.
+
+    The last `window` characters are held back (and never cut inside a match
+    that reaches them) so secrets straddling a piece boundary are still found.
+    """
+    carry = ""
+    for piece in pieces:
+        buf = carry + piece
+        safe = len(buf) - window
+        if safe <= 0:
+            carry = buf
+            continue
+        spans = find_secret_spans(buf)
+        cut = safe
+        for s, e in spans:
+            if s < cut < e:
+                cut = s
+                break
+        done = [(s, e) for s, e in spans if e <= cut]
+        if cut > 0:
+            yield _apply_spans(buf, done, 0, cut)
+        carry = buf[cut:]
+    if carry:
+        yield mask_with_count(carry)
+
+
+def mostly_masked_count(original_len: int, masked_chars: int, threshold: float = 0.6) -> bool:
+    if not original_len:
+        return True
+    return (masked_chars / original_len) >= threshold
 
 
 def mostly_masked(original: str, masked: str, threshold: float = 0.6) -> bool:
@@ -69,8 +285,5 @@ def mostly_masked(original: str, masked: str, threshold: float = 0.6) -> bool:
 
 
 def staged_has_excluded(paths: Iterable[str]) -> list[str]:
-    bad = []
-    for p in paths:
-        if is_excluded_path(Path(p)):
-            bad.append(p)
-    return bad
+    search = EXCLUDED_MATCHER.search
+    return [p for p in paths if search(p) is not None]
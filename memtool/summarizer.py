@@ -1,16 +1,131 @@
 from __future__ import annotations
 
 import math
-from typing import Dict, Any, List
+import time
+from typing import TYPE_CHECKING, Dict, Any, List
 
 import click
-from openai import OpenAI
 
-from .token_budget import messages_token_count
+from . import tracing
+from .lexical import BM25Index
+from .memory_store import memory_stats
+from .token_budget import count_tokens, message_tokens, truncate_to_tokens
+
+if TYPE_CHECKING:  # pragma: no cover
+    from openai import OpenAI
 
 
 SUMMARY_MIN = 220
 SUMMARY_MAX = 350
+# Ceiling of long_term_memory, the digest every chat turn includes whole.
+LONG_TERM_MAX_TOKENS = 600
+# Sections at one level that are rolled up into one section a level higher.
+ROLLUP_FANOUT = 4
+# Prompt tokens given to summary sections picked by relevance to the question.
+SECTION_CONTEXT_TOKENS = 800
+HEADINGS = "Use EXACT headings: Data model, APIs, Decisions, Open questions, Next steps."
+
+
+def _complete(client: OpenAI, model: str, system_prompt: str, user_content: str) -> str:
+    try:
+        with tracing.span("summarize.request", model=model) as s:
+            if tracing.enabled():
+                s.set(tokens_sent=count_tokens(system_prompt) + count_tokens(user_content))
+            resp = client.chat.completions.create(
+                model=model,
+                temperature=0.2,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_content},
+                ],
+            )
+    except Exception as exc:  # pragma: no cover - network
+        raise click.ClickException(f"OpenAI summarization failed: {exc}") from exc
+    return resp.choices[0].message.content.strip()
+
+
+def _section(level: int, text: str, messages: int) -> Dict[str, Any]:
+    text = truncate_to_tokens(text, SUMMARY_MAX)
+    return {"level": level, "text": text, "tokens": count_tokens(text), "messages": messages, "created": int(time.time())}
+
+
+def split_long_term(text: str) -> List[Dict[str, Any]]:
+    """Level-0 sections from an unbounded long_term_memory, packed paragraph by paragraph."""
+    sections: List[Dict[str, Any]] = []
+    current: List[str] = []
+    used = 0
+    for para in (p.strip() for p in text.split("\n\n")):
+        if not para:
+            continue
+        tokens = count_tokens(para)
+        if current and used + tokens > SUMMARY_MAX:
+            sections.append(_section(0, "\n\n".join(current), 0))
+            current, used = [], 0
+        current.append(para)
+        used += tokens
+    if current:
+        sections.append(_section(0, "\n\n".join(current), 0))
+    return sections
+
+
+def summarize_window(client: OpenAI, model: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Level-0 section: a summary of one window of messages."""
+    system_prompt = (
+        "You are a senior software engineer. Summarize the following conversation.\n"
+        f"Target {SUMMARY_MIN}-{SUMMARY_MAX} tokens. Preserve file/function names, interfaces, constraints, TODOs.\n"
+        + HEADINGS
+    )
+    user_content = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in messages)
+    return _section(0, _complete(client, model, system_prompt, user_content), len(messages))
+
+
+def roll_up(client: OpenAI, model: str, sections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge every ROLLUP_FANOUT oldest sections of a level into one a level higher.
+
+    Repeats until no level has ROLLUP_FANOUT sections, so a history of n windows
+    keeps O(ROLLUP_FANOUT * log n) sections, each at most SUMMARY_MAX tokens.
+    Sections stay in chronological order.
+    """
+    system_prompt = (
+        "You are a senior software engineer. Merge these consecutive project summaries into one.\n"
+        f"At most {SUMMARY_MAX} tokens. Keep decisions, interfaces and open items; drop detail later summaries supersede.\n"
+        + HEADINGS
+    )
+    while True:
+        levels: Dict[int, List[int]] = {}
+        for i, sec in enumerate(sections):
+            levels.setdefault(sec.get("level", 0), []).append(i)
+        full = next((rows for _, rows in sorted(levels.items()) if len(rows) >= ROLLUP_FANOUT), None)
+        if full is None:
+            return sections
+        group = full[:ROLLUP_FANOUT]
+        children = [sections[i] for i in group]
+        text = _complete(client, model, system_prompt, "\n\n---\n\n".join(c["text"] for c in children))
+        parent = _section(children[0].get("level", 0) + 1, text, sum(c.get("messages", 0) for c in children))
+        sections = [parent if i == group[0] else sec for i, sec in enumerate(sections) if i not in group[1:]]
+
+
+def update_digest(client: OpenAI, model: str, digest: str, section: Dict[str, Any]) -> str:
+    """Fold a new section into long_term_memory, keeping it within LONG_TERM_MAX_TOKENS."""
+    system_prompt = (
+        "You are a senior software engineer. Update the project's long-term memory with the new summary.\n"
+        f"At most {LONG_TERM_MAX_TOKENS} tokens. Keep what still holds; when space runs out drop the least "
+        "important or most superseded detail first.\n" + HEADINGS
+    )
+    user_content = f"[EXISTING LONG TERM]\n{digest}\n\n[NEW SUMMARY]\n{section['text']}"
+    return truncate_to_tokens(_complete(client, model, system_prompt, user_content), LONG_TERM_MAX_TOKENS)
+
+
+def needs_summary(memory: Dict[str, Any], hard_budget_tokens: int) -> bool:
+    """Whether the unpinned history is over 70% of the budget.
+
+    Pinned messages never leave the history, so they don't count towards it.
+    """
+    threshold = math.floor(hard_budget_tokens * 0.7)
+    if not memory.get("messages") or memory_stats(memory)["message_tokens"] <= threshold:
+        return False
+    pinned = sum(message_tokens(m) for m in memory["messages"] if m.get("pinned"))
+    return memory["stats"]["message_tokens"] - pinned > threshold
 
 
 def summarize_if_needed(
@@ -19,43 +134,58 @@ def summarize_if_needed(
     model: str,
     hard_budget_tokens: int,
 ) -> Dict[str, Any]:
-    messages: List[Dict[str, str]] = memory.get("messages", [])
-    if not messages:
+    """Move the oldest half of the unpinned history into a level-0 section and refresh the digest."""
+    if not needs_summary(memory, hard_budget_tokens):
         return memory
+    with tracing.span("summarize", messages=len(memory["messages"])):
+        return _summarize(client, memory, model)
 
-    if messages_token_count(messages) <= math.floor(hard_budget_tokens * 0.7):
-        return memory
 
-    half = max(1, len(messages) // 2)
-    to_summarize = messages[:half]
-    remaining = messages[half:]
-
-    system_prompt = (
-        "You are a senior software engineer. Summarize the following conversation into long-term memory.\n"
-        f"Target {SUMMARY_MIN}-{SUMMARY_MAX} tokens. Preserve file/function names, interfaces, constraints, TODOs.\n"
-        "Use EXACT headings: Data model, APIs, Decisions, Open questions, Next steps."
-    )
-    user_content = (
-        f"[EXISTING LONG TERM]\n{memory.get('long_term_memory', '')}\n\n"
-        "[MESSAGES TO SUMMARIZE]\n"
-        + "\n".join(f"{m.get('role')}: {m.get('content')}" for m in to_summarize)
-    )
+def _summarize(client: OpenAI, memory: Dict[str, Any], model: str) -> Dict[str, Any]:
+    messages: List[Dict[str, Any]] = memory["messages"]
 
-    try:
-        resp = client.chat.completions.create(
-            model=model,
-            temperature=0.2,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content},
-            ],
-        )
-    except Exception as exc:  # pragma: no cover - network
-        raise click.ClickException(f"OpenAI summarization failed: {exc}") from exc
+    # Pinned messages stay in the history and are never folded.
+    unpinned = [i for i, m in enumerate(messages) if not m.get("pinned")]
+    if not unpinned:
+        return memory
+    folded = set(unpinned[: max(1, len(unpinned) // 2)])
+    to_summarize = [messages[i] for i in sorted(folded)]
+    remaining = [m for i, m in enumerate(messages) if i not in folded]
 
-    summary = resp.choices[0].message.content.strip()
-    lt = memory.get("long_term_memory", "")
-    new_long_term = f"{lt}\n\n{summary}".strip()
-    memory["long_term_memory"] = new_long_term
+    sections = list(memory.get("summaries", []))
+    digest = memory.get("long_term_memory", "")
+    if count_tokens(digest) > LONG_TERM_MAX_TOKENS:
+        # Long-term memory from before it was bounded becomes the oldest sections.
+        sections = split_long_term(digest) + sections
+    section = summarize_window(client, model, to_summarize)
+    summaries = roll_up(client, model, sections + [section])
+    long_term = update_digest(client, model, digest, section)
+    # Assigned only once every call succeeded, so a failure leaves memory as it was.
+    memory["summaries"] = summaries
+    memory["long_term_memory"] = long_term
     memory["messages"] = remaining
+    memory_stats(memory)
     return memory
+
+
+def relevant_sections(memory: Dict[str, Any], query: str, budget: int = SECTION_CONTEXT_TOKENS) -> List[str]:
+    """Summary section texts for query within budget tokens, oldest first.
+
+    Sections are ranked by BM25 against the query; leftover budget goes to the
+    newest sections.
+    """
+    sections = memory.get("summaries") or []
+    if not sections:
+        return []
+    index = BM25Index.build({"id": i, "text": sec.get("text", "")} for i, sec in enumerate(sections))
+    ranked = [i for _, i in index.search(query, len(sections))]
+    ranked += [i for i in range(len(sections) - 1, -1, -1) if i not in ranked]
+    chosen: List[int] = []
+    used = 0
+    for i in ranked:
+        tokens = sections[i].get("tokens") or count_tokens(sections[i].get("text", ""))
+        if used + tokens > budget:
+            continue
+        chosen.append(i)
+        used += tokens
+    return [sections[i]["text"] for i in sorted(chosen)]
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+
+from memtool.memory_store import MemoryDoc, load_memory_file, save_memory_file
+from memtool.retrieval import index_files
+
+LOCAL_MODEL = "local-hashing-64"
+
+
+class Project:
+    """A scratch source tree plus a memory file, indexed with the local embedder."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.memory_file = root / "project_memory" / "test.json"
+
+    def write(self, files: Dict[str, str]) -> None:
+        for rel, text in files.items():
+            path = self.root / "src" / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text, encoding="utf-8")
+
+    def load(self) -> MemoryDoc:
+        return load_memory_file(self.memory_file)
+
+    def index(self, memory: MemoryDoc | None = None, client: Any = None, model: str = LOCAL_MODEL, **kwargs) -> MemoryDoc:
+        memory = self.load() if memory is None else memory
+        index_files(client, memory, [Path("src")], model, 200, 0, processes=0, use_git=False, **kwargs)
+        save_memory_file(memory)
+        return memory
+
+
+@pytest.fixture
+def project(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Project:
+    monkeypatch.chdir(tmp_path)
+    return Project(tmp_path)
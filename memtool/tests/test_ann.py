@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import pytest
+
+from memtool.ann import IVFIndex, update_ann
+from memtool.embedding_store import EmbeddingMatrix, docs_matrix
+
+np = pytest.importorskip("numpy")
+
+
+def clustered(n: int, dim: int = 16, clusters: int = 8, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    data = centers[rng.integers(clusters, size=n)] + 0.1 * rng.normal(size=(n, dim))
+    return (data / np.linalg.norm(data, axis=1, keepdims=True)).astype(np.float32)
+
+
+def exact(data, query, k):
+    scores = data @ (query / np.linalg.norm(query))
+    return [int(i) for i in np.argsort(-scores, kind="stable")[:k]]
+
+
+def test_probing_every_list_is_exact() -> None:
+    data = clustered(500)
+    index = IVFIndex.train(data, nlist=10)
+    for q in clustered(20, seed=1):
+        assert [row for _, row in index.search(data, q, 5, nprobe=10)] == exact(data, q, 5)
+
+
+def test_few_probes_find_near_neighbours() -> None:
+    data = clustered(2000)
+    index = IVFIndex.train(data)
+    queries = data[::50] + 0.01
+    hits = sum(exact(data, q, 1)[0] in [row for _, row in index.search(data, q, 5, nprobe=4)] for q in queries)
+    assert hits / len(queries) >= 0.9
+
+
+def test_keep_and_add_follow_the_matrix() -> None:
+    data = clustered(300)
+    index = IVFIndex.train(data, nlist=6)
+    keep = list(range(0, 300, 2))
+    index.keep(keep)
+    added = clustered(40, seed=2)
+    index.add(added)
+    rows = np.concatenate([data[keep], added])
+    assert len(index.assign) == len(rows)
+    q = added[3]
+    assert [row for _, row in index.search(rows, q, 3, nprobe=6)] == exact(rows, q, 3)
+
+
+def test_update_ann_builds_and_retrains_with_growth() -> None:
+    idx = {}
+    matrix = EmbeddingMatrix.from_rows(clustered(50).tolist())
+    update_ann(idx, matrix, None, 50, min_chunks=100)
+    assert "_ann" not in idx
+    matrix.extend(clustered(60, seed=3).tolist())
+    update_ann(idx, matrix, None, 60, min_chunks=100)
+    assert idx["_ann"].trained_on == 110
+    matrix.extend(clustered(20, seed=4).tolist())
+    update_ann(idx, matrix, None, 20, min_chunks=100)
+    assert idx["_ann"].trained_on == 110 and len(idx["_ann"].assign) == 130
+    matrix.extend(clustered(400, seed=5).tolist())
+    update_ann(idx, matrix, None, 400, min_chunks=100)
+    assert idx["_ann"].trained_on == 530
+
+
+def test_index_survives_a_save_and_load(project) -> None:
+    project.write({f"f{i}.py": f"def handler{i}(): return 'value {i % 7}'\n" for i in range(40)})
+    project.index(ann_min_chunks=20)
+    idx = project.load()["docs_index"]
+    ann = idx["_ann"]
+    assert len(ann.assign) == 40 and idx["ann"]["nlist"] == ann.nlist
+    data = docs_matrix(idx).as_numpy()
+    q = data[7]
+    assert [row for _, row in ann.search(data, q, 3, nprobe=ann.nlist)] == exact(data, q, 3)
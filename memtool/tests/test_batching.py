@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import click
+import pytest
+
+from memtool import batching
+from memtool.batching import embed_batched, load_checkpoint, plan_batches
+from memtool.fakes import FakeOpenAI, fake_embedding
+
+MODEL = "text-embedding-3-small"
+DIM = 4
+
+
+class PoisonedClient:
+    """FakeOpenAI whose requests fail while they contain a poisoned text."""
+
+    def __init__(self, poison: str) -> None:
+        self.inner = FakeOpenAI(dim=DIM)
+        self.poison = poison
+        self.embeddings = self
+
+    def create(self, model, input):
+        if self.poison in input:
+            raise RuntimeError("bad input")
+        return self.inner.embeddings.create(model=model, input=input)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(batching, "BACKOFF_BASE", 0.0)
+
+
+def test_plan_batches_bounds_items_and_tokens() -> None:
+    batches = plan_batches(["t"] * 7, max_tokens=10, max_items=3, token_counts=[2, 2, 2, 2, 9, 30, 1])
+    assert batches == [[0, 1, 2], [3], [4], [5], [6]]
+
+
+def test_results_keep_input_order_across_workers() -> None:
+    texts = [f"text {i}" for i in range(50)]
+    client = FakeOpenAI(dim=DIM)
+    vectors = embed_batched(client, MODEL, texts, max_items=3, workers=4, token_counts=[1] * 50)
+    assert vectors == [fake_embedding(t, DIM) for t in texts]
+    assert client.embedding_calls == 17
+
+
+def test_transient_failures_are_retried() -> None:
+    client = FakeOpenAI(dim=DIM, failure_rate=0.3, seed=1)
+    texts = [f"text {i}" for i in range(40)]
+    assert embed_batched(client, MODEL, texts, max_items=2, workers=2) == [fake_embedding(t, DIM) for t in texts]
+    assert client.embedding_calls > 20
+
+
+def test_failed_run_resumes_from_checkpoint(tmp_path) -> None:
+    checkpoint = tmp_path / "ckpt.jsonl"
+    texts = [f"text {i}" for i in range(10)]
+    client = PoisonedClient("text 7")
+    with pytest.raises(click.ClickException, match="rerun to resume"):
+        embed_batched(client, MODEL, texts, max_items=2, workers=1, retries=1, checkpoint=checkpoint)
+    assert len(load_checkpoint(checkpoint)) == 3
+
+    # A crash can tear the last line; that batch is simply redone.
+    with checkpoint.open("a") as fh:
+        fh.write('{"key": "trunc')
+    client = FakeOpenAI(dim=DIM)
+    vectors = embed_batched(client, MODEL, texts, max_items=2, workers=1, checkpoint=checkpoint)
+    assert vectors == [fake_embedding(t, DIM) for t in texts]
+    assert client.embedded_texts == 4
+    assert not checkpoint.exists()
+
+
+def test_resume_skips_reading_the_checkpoint(tmp_path) -> None:
+    checkpoint = tmp_path / "ckpt.jsonl"
+    texts = ["a", "b"]
+    embed_batched(FakeOpenAI(dim=DIM), MODEL, texts, max_items=1, checkpoint=checkpoint, keep_checkpoint=True)
+    done = load_checkpoint(checkpoint)
+    assert len(done) == 2
+    checkpoint.unlink()
+
+    client = FakeOpenAI(dim=DIM)
+    assert embed_batched(client, MODEL, texts, max_items=1, checkpoint=checkpoint, resume=done) == [
+        fake_embedding(t, DIM) for t in texts
+    ]
+    assert client.embedding_calls == 0
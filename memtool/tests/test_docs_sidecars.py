@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import shutil
+
+import click
+import pytest
+
+from memtool.ann import ann_paths
+from memtool.embedders import HashingEmbedder
+from memtool.embedding_store import docs_matrix, vectors_path
+from memtool.lexical import get_lexical, lexical_path
+
+
+def sidecars(project):
+    return [vectors_path(project.memory_file), lexical_path(project.memory_file), *ann_paths(project.memory_file)]
+
+
+def take_sidecars_from(project, other_commit):
+    """What git does when only the other side changed the sidecars but both changed docs.json."""
+    for saved, path in zip(other_commit, sidecars(project)):
+        shutil.copyfile(saved, path)
+
+
+def snapshot(project, tmp_path, name):
+    copies = []
+    for path in sidecars(project):
+        copy = tmp_path / f"{name}{path.suffix}.{len(copies)}"
+        shutil.copyfile(path, copy)
+        copies.append(copy)
+    return copies
+
+
+def test_sidecars_from_another_commit_are_not_used(project, tmp_path) -> None:
+    project.write({f"f{i}.py": f"def alpha{i}(): return 'apples {i}'\n" for i in range(30)})
+    project.index(ann_min_chunks=10)
+    other = snapshot(project, tmp_path, "other")
+
+    project.write({"f1.py": "def alpha1(): return 'zebra stripes'\n"})
+    project.index(ann_min_chunks=10)
+    take_sidecars_from(project, other)
+
+    memory = project.load()
+    idx = memory["docs_index"]
+    with pytest.raises(click.ClickException, match="index-files"):
+        docs_matrix(idx)
+    assert "_ann" not in idx
+    # BM25 is rebuilt from the chunks docs_index holds.
+    assert get_lexical(idx).search("zebra", 1)[0][1] == "src/f1.py:0"
+
+    # The next index-files run re-embeds every file.
+    project.index(memory, ann_min_chunks=10)
+    idx = project.load()["docs_index"]
+    matrix = docs_matrix(idx)
+    expected = HashingEmbedder(64).embed([ch["text"] for ch in idx["chunks"]])
+    for row, vec in zip(matrix.rows(), expected):
+        assert list(row) == pytest.approx(vec, abs=1e-6)
+    assert "_ann" in idx
+
+
+def test_matching_sidecars_are_used(project) -> None:
+    project.write({"a.py": "def a(): pass\n", "b.py": "def b(): pass\n"})
+    project.index()
+    idx = project.load()["docs_index"]
+    assert len(docs_matrix(idx)) == 2
+    assert not get_lexical(idx).dirty
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import json
+import math
+
+import click
+import pytest
+
+from memtool.embedding_store import EmbeddingMatrix, docs_matrix, vectors_path
+from memtool.memory_store import load_memory_file, save_memory_file, section_paths
+
+
+def unit(vec):
+    norm = math.sqrt(sum(x * x for x in vec))
+    return [x / norm for x in vec] if norm else list(vec)
+
+
+def test_inline_embeddings_move_to_the_sidecar(tmp_path) -> None:
+    path = tmp_path / "project_memory" / "m.json"
+    path.parent.mkdir()
+    inline = [[3.0, 4.0, 0.0], [0.0, 0.0, 2.0], [1.0, 1.0, 1.0]]
+    chunks = [{"id": f"src/a.py:{i}", "text": f"chunk {i}", "embedding": vec} for i, vec in enumerate(inline)]
+    path.write_text(json.dumps({"messages": [], "long_term_memory": "", "docs_index": {"chunks": chunks}}))
+
+    save_memory_file(load_memory_file(path))
+
+    docs = json.loads(section_paths(path)["docs_index"].read_text())
+    assert not any("embedding" in ch for ch in docs["chunks"])
+    assert docs["vectors"]["count"] == 3 and docs["vectors"]["dim"] == 3
+    assert vectors_path(path).exists()
+
+    matrix = docs_matrix(load_memory_file(path)["docs_index"])
+    for row, vec in zip(matrix.rows(), inline):
+        assert list(row) == pytest.approx(unit(vec))
+
+
+def test_rows_are_unit_normalized_and_kept_in_order() -> None:
+    matrix = EmbeddingMatrix.from_rows([[2.0, 0.0], [0.0, 0.0], [1.0, 1.0]])
+    assert list(matrix.row(0)) == [1.0, 0.0]
+    assert list(matrix.row(1)) == [0.0, 0.0]
+    matrix.keep([2, 0])
+    assert [list(r) for r in matrix.rows()] == [pytest.approx(unit([1.0, 1.0])), [1.0, 0.0]]
+
+
+def test_sidecar_of_the_wrong_size_is_refused(tmp_path) -> None:
+    path = tmp_path / "m.vectors.f32"
+    EmbeddingMatrix.from_rows([[1.0, 0.0]]).save(path)
+    with pytest.raises(click.ClickException, match="Re-index to repair"):
+        EmbeddingMatrix.open(path, 2, 2)
+    assert list(EmbeddingMatrix.open(path, 2, 1).row(0)) == [1.0, 0.0]
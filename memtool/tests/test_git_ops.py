@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import click
+import pytest
+
+from memtool import git_ops
+
+
+def git(cwd: Path, *args: str) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    for var, value in (("NAME", "memtool"), ("EMAIL", "memtool@example.com")):
+        monkeypatch.setenv(f"GIT_AUTHOR_{var}", value)
+        monkeypatch.setenv(f"GIT_COMMITTER_{var}", value)
+    root = tmp_path / "repo"
+    root.mkdir()
+    git(root, "init", "-q", "-b", "main")
+    (root / "README.md").write_text("hello\n")
+    git(root, "add", "README.md")
+    git(root, "commit", "-qm", "init")
+    monkeypatch.chdir(root)
+    return root
+
+
+def test_pull_without_upstream_says_so(repo: Path) -> None:
+    with pytest.raises(click.ClickException, match="Branch 'main' has no upstream configured"):
+        git_ops.pull_if_moved()
+
+
+def test_pull_on_detached_head_says_so(repo: Path) -> None:
+    git(repo, "checkout", "-q", "--detach")
+    with pytest.raises(click.ClickException, match="HEAD is detached"):
+        git_ops.pull_if_moved()
+
+
+@pytest.fixture
+def clone(repo: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    origin = tmp_path / "origin.git"
+    git(tmp_path, "clone", "-q", "--bare", str(repo), str(origin))
+    root = tmp_path / "clone"
+    git(tmp_path, "clone", "-q", str(origin), str(root))
+    (root / "project_memory").mkdir()
+    monkeypatch.chdir(root)
+    return root
+
+
+def remember(root: Path, text: str) -> None:
+    path = root / "project_memory" / "m.messages.jsonl"
+    with path.open("a") as fh:
+        fh.write(text + "\n")
+
+
+def ahead(root: Path) -> int:
+    return int(git(root, "rev-list", "--count", "@{u}..HEAD"))
+
+
+def test_unpushed_memory_commits_are_coalesced(clone: Path) -> None:
+    remember(clone, "one")
+    assert git_ops.commit_local("memory")
+    remember(clone, "two")
+    assert git_ops.commit_local("memory")
+    assert ahead(clone) == 1
+    assert git(clone, "show", "HEAD:project_memory/m.messages.jsonl") == "one\ntwo"
+    assert not git_ops.commit_local("memory")
+
+
+def test_pushed_and_foreign_commits_are_not_amended(clone: Path) -> None:
+    remember(clone, "one")
+    git_ops.commit_local("memory")
+    assert git_ops.sync() == 1
+    pushed = git(clone, "rev-parse", "HEAD")
+
+    remember(clone, "two")
+    git_ops.commit_local("memory")
+    assert git(clone, "rev-parse", "HEAD~1") == pushed
+    assert ahead(clone) == 1
+
+    (clone / "notes.txt").write_text("mine\n")
+    git(clone, "add", "notes.txt")
+    git(clone, "commit", "-qm", "my own work")
+    remember(clone, "three")
+    git_ops.commit_local("memory")
+    assert ahead(clone) == 3
+    assert git(clone, "log", "-1", "--format=%s", "HEAD~1") == "my own work"
+
+    assert git_ops.sync() == 3
+    assert ahead(clone) == 0
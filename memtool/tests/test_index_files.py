@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import pytest
+
+from memtool import retrieval
+from memtool.embedding_store import docs_matrix
+from memtool.fakes import FakeOpenAI
+
+MODEL = "text-embedding-3-small"
+
+
+class Crash(BaseException):
+    """Stands in for the process dying mid-run (not retried like API errors)."""
+
+
+class CrashingClient:
+    def __init__(self, inner: FakeOpenAI, calls: int) -> None:
+        self.inner = inner
+        self.calls = calls
+        self.embeddings = self
+
+    def create(self, **kwargs):
+        if self.calls == 0:
+            raise Crash()
+        self.calls -= 1
+        return self.inner.embeddings.create(**kwargs)
+
+
+def test_interrupted_run_resumes_from_checkpoint_read_once(project, tmp_path, monkeypatch) -> None:
+    project.write({f"f{i}.py": f"def f{i}(): return {i}\n" for i in range(10)})
+    checkpoint = tmp_path / "embed_checkpoint.jsonl"
+    opts = dict(model=MODEL, checkpoint=checkpoint, batch_items=2, workers=1)
+
+    with pytest.raises(Crash):
+        project.index(client=CrashingClient(FakeOpenAI(dim=8), calls=3), **opts)
+    assert len(checkpoint.read_text().splitlines()) == 3
+
+    reads = []
+    load = retrieval.load_checkpoint
+    monkeypatch.setattr(retrieval, "load_checkpoint", lambda path: reads.append(path) or load(path))
+    client = FakeOpenAI(dim=8)
+    memory = project.index(client=client, **opts)
+    assert reads == [checkpoint]
+    assert client.embedded_texts == 4
+    assert not checkpoint.exists()
+
+    idx = memory["docs_index"]
+    expected = FakeOpenAI(dim=8).embeddings.create(model=MODEL, input=[ch["text"] for ch in idx["chunks"]]).data
+    for row, item in zip(docs_matrix(idx).rows(), expected):
+        norm = sum(x * x for x in item.embedding) ** 0.5
+        assert list(row) == pytest.approx([x / norm for x in item.embedding], abs=1e-6)
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import random
+
+from memtool.lexical import BM25Index, rrf_fuse
+
+WORDS = ["alpha", "beta", "gamma", "delta", "profileShare", "user_id", "token", "cache", "merge", "vector"]
+
+
+def chunk(i: int, rng: random.Random):
+    return {"id": f"src/f{i}.py:0", "text": " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))}
+
+
+def ranked(index: BM25Index, query: str):
+    return sorted((cid, round(score, 9)) for score, cid in index.search(query, 1000))
+
+
+def test_add_and_remove_match_a_rebuild() -> None:
+    rng = random.Random(0)
+    chunks = [chunk(i, rng) for i in range(300)]
+    index = BM25Index.build(chunks)
+
+    removed = rng.sample(chunks, 60)
+    index.remove(removed)
+    # Re-added ids replace their doc, including terms only the old text had.
+    replaced = [{"id": ch["id"], "text": "zebra"} for ch in rng.sample(chunks, 20)]
+    index.add(replaced)
+    added = [chunk(i, rng) for i in range(300, 340)]
+    index.add(added)
+
+    final = {ch["id"]: ch for ch in chunks}
+    for ch in removed:
+        final.pop(ch["id"], None)
+    final.update((ch["id"], ch) for ch in replaced + added)
+    rebuilt = BM25Index.build(final.values())
+
+    assert index.live == rebuilt.live == len(final)
+    assert index.total_len == rebuilt.total_len
+    for query in WORDS + ["zebra", "profile share", "alpha zebra cache"]:
+        assert ranked(index, query) == ranked(rebuilt, query), query
+    assert {t: len(p) for t, p in index.postings.items()} == {t: len(p) for t, p in rebuilt.postings.items()}
+
+
+def test_removing_unknown_chunks_changes_nothing() -> None:
+    index = BM25Index.build([{"id": "a", "text": "alpha beta"}])
+    index.dirty = False
+    index.remove([{"id": "b", "text": "alpha"}])
+    assert not index.dirty
+    assert index.search("alpha", 5)[0][1] == "a"
+
+
+def test_json_round_trip_and_compaction() -> None:
+    index = BM25Index.build({"id": str(i), "text": f"word{i} shared"} for i in range(8))
+    index.remove({"id": str(i), "text": f"word{i} shared"} for i in range(3))
+    assert index.needs_compaction()
+    loaded = BM25Index.from_json(index.to_json())
+    assert ranked(loaded, "shared word5") == ranked(index, "shared word5")
+
+
+def test_identifier_parts_match() -> None:
+    index = BM25Index.build([{"id": "a", "text": "ProfileShare"}, {"id": "b", "text": "profile"}])
+    assert {cid for _, cid in index.search("share", 5)} == {"a"}
+
+
+def test_rrf_fuse_prefers_rows_both_rankings_found() -> None:
+    assert rrf_fuse([[1, 2], [3, 2]], 1) == [2]
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from memtool.merge import merge_messages
+
+
+def msg(content: str, role: str = "user", **extra):
+    return {"role": role, "content": content, **extra}
+
+
+def test_token_stamps_do_not_change_identity() -> None:
+    base = [msg("a"), msg("b")]
+    # Ours re-counted the history with another tokenizer; theirs summarized "a" away.
+    ours = [msg("a", tokens=1, tokenizer="o200k_base"), msg("b", tokens=1, tokenizer="o200k_base")]
+    theirs = [msg("b", tokens=2, tokenizer="cl100k_base"), msg("c")]
+    assert merge_messages(base, ours, theirs) == [ours[1], msg("c")]
+
+
+def test_pinned_flag_is_part_of_identity() -> None:
+    base = [msg("a")]
+    theirs = [msg("a", pinned=True)]
+    assert merge_messages(base, [msg("a")], theirs) == [msg("a", pinned=True)]
+
+
+def test_repeated_messages_and_order_are_kept() -> None:
+    base = [msg("hi"), msg("ok", "assistant")]
+    ours = base + [msg("hi"), msg("ok", "assistant")]
+    theirs = base + [msg("ok", "assistant"), msg("thanks")]
+    assert merge_messages(base, ours, theirs) == base + [
+        msg("hi"),
+        msg("ok", "assistant"),
+        msg("ok", "assistant"),
+        msg("thanks"),
+    ]
+
+
+def test_dropping_one_copy_keeps_the_other() -> None:
+    base = [msg("ok"), msg("x"), msg("ok")]
+    ours = base + [msg("y")]
+    theirs = [msg("x"), msg("ok")]
+    assert merge_messages(base, ours, theirs) == [msg("x"), msg("ok"), msg("y")]
+
+
+def test_summary_sections_merge_by_content() -> None:
+    s = [{"level": 0, "text": f"s{i}", "messages": 2, "created": i, "tokens": 1} for i in range(5)]
+    parent = {"level": 1, "text": "p", "messages": 8, "created": 9, "tokens": 1}
+    # Theirs rolled the first four up; ours added a fifth section.
+    assert merge_messages(s[:4], s, [parent]) == [parent, s[4]]
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import random
+from typing import List, Set
+
+import pytest
+
+from memtool.secret_scrubber import MASK, SECRET_PATTERNS, find_secret_spans, mask, mask_stream
+
+FRAGMENTS = [
+    "Authorization", "authorization", "auth", "token", "password", "pwd", "secret", "api_key", "apikey",
+    ": ", "=", " = ", ":", "Bearer ", "bearer  ", "eyJhbGciOi", ".", "eyJzdWIi", "Sfl", "sk_live_", "AKIA",
+    "ABCDEFGHIJKLMNOP", "ghp_", "xoxb-", "AIza", "https://", "postgres://", "user", ":", "pass", "@", "host",
+    "/path", "abc", "def", "+", "/", "~", "==", "*", "-", "_", "'", '"', " ", "  ", "\n", "\t", "x", "42",
+]
+
+
+def legacy_masked_chars(text: str) -> Set[int]:
+    """Offsets of text that the original one-re.sub-per-pattern scrubber masked."""
+    # Each entry is an original offset, or None for a mask character.
+    current: List[int | None] = list(range(len(text)))
+    masked: Set[int] = set()
+    for pattern in SECRET_PATTERNS:
+        chars = "".join("*" if i is None else text[i] for i in current)
+        out: List[int | None] = []
+        cursor = 0
+        for m in pattern.finditer(chars):
+            out.extend(current[cursor:m.start()])
+            masked.update(i for i in current[m.start():m.end()] if i is not None)
+            out.extend([None] * len(MASK))
+            cursor = m.end()
+        out.extend(current[cursor:])
+        current = out
+    return masked
+
+
+def samples(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choices(FRAGMENTS, k=rng.randint(1, 14))) for _ in range(n)]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Authorization: Bearer abc+def/ghi==",
+        "auth: Bearer eyJhbGciOi.eyJzdWIi.Sfl+KxwRJ/SM=",
+        "token = Bearer abc~def",
+    ],
+)
+def test_keyword_takes_in_masked_value(text: str) -> None:
+    assert mask(text) == MASK
+
+
+def test_masks_everything_sequential_substitution_masked() -> None:
+    for text in samples(5000):
+        covered = {i for s, e in find_secret_spans(text) for i in range(s, e)}
+        leaked = legacy_masked_chars(text) - covered
+        assert not leaked, (text, mask(text), sorted(leaked))
+
+
+def test_stream_matches_single_pass() -> None:
+    rng = random.Random(1)
+    for text in samples(1000, seed=2):
+        text = " ".join([text] * 6)
+        cuts = sorted(rng.sample(range(1, len(text)), min(5, len(text) - 1)))
+        pieces = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        streamed = "".join(part for part, _ in mask_stream(pieces, window=256))
+        assert streamed == mask(text), text
@@ -0,0 +1,14 @@
+from __future__ import annotations
+
+from memtool.bench import HEAVY_MODULES, STARTUP_BUDGET_MS, import_profile
+
+
+def test_help_stays_within_the_import_budget() -> None:
+    baseline, _ = import_profile(["-c", "pass"])
+    best = float("inf")
+    for _ in range(3):
+        top, seen = import_profile(["-m", "memtool.cli", "--help"])
+        heavy = [m for m in HEAVY_MODULES if m in seen]
+        assert not heavy, f"`memtool --help` imported {', '.join(heavy)}"
+        best = min(best, sum(us for name, us in top.items() if name not in baseline) / 1000)
+    assert best <= STARTUP_BUDGET_MS, f"memtool's imports for --help took {best:.1f} ms"
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from memtool.fakes import FakeOpenAI
+from memtool.memory_store import append_messages
+from memtool.summarizer import needs_summary, summarize_if_needed
+
+BUDGET = 400
+
+
+def message(i: int, pinned: bool = False):
+    m = {"role": "user", "content": f"message {i} " + "words " * 40}
+    if pinned:
+        m["pinned"] = True
+    return m
+
+
+def test_pinned_history_is_not_summarized_again_every_turn() -> None:
+    client = FakeOpenAI()
+    memory = {"messages": [], "summaries": [], "long_term_memory": ""}
+    append_messages(memory, [message(i, pinned=True) for i in range(20)])
+    assert not needs_summary(memory, BUDGET)
+
+    for turn in range(5):
+        append_messages(memory, [message(100 + turn)])
+        summarize_if_needed(client, memory, "fake", BUDGET)
+    assert client.chat_calls == 0
+    assert memory["summaries"] == []
+
+
+def test_only_unpinned_messages_are_folded() -> None:
+    client = FakeOpenAI()
+    memory = {"messages": [], "summaries": [], "long_term_memory": ""}
+    history = [message(i, pinned=i % 3 == 0) for i in range(30)]
+    append_messages(memory, history)
+    assert needs_summary(memory, BUDGET)
+
+    summarize_if_needed(client, memory, "fake", BUDGET)
+    pinned = [m for m in history if m.get("pinned")]
+    unpinned = [m for m in history if not m.get("pinned")]
+    assert memory["summaries"][0]["messages"] == len(unpinned) // 2
+    assert memory["messages"] == [m for m in history if m.get("pinned") or m in unpinned[len(unpinned) // 2:]]
+    assert all(m in memory["messages"] for m in pinned)
+    assert memory["stats"]["message_count"] == len(memory["messages"])
+
+    # With every unpinned message folded away, a forced run has nothing to do.
+    memory["messages"] = pinned
+    before = client.chat_calls
+    summarize_if_needed(client, memory, "fake", 0)
+    assert client.chat_calls == before
+    assert memory["messages"] == pinned
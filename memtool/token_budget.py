@@ -1,36 +1,156 @@
 from __future__ import annotations
 
+import functools
+import hashlib
 import math
-from typing import Iterable, List, Dict, Any
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Dict, Any, Optional, Tuple
 
-try:
-    import tiktoken
-except ImportError:  # pragma: no cover - optional
-    tiktoken = None
+from .utils import lazy_import
 
+tiktoken = lazy_import("tiktoken")
 
-def _encode(text: str) -> List[int]:
+
+DEFAULT_ENCODING = "cl100k_base"
+# Embedding models tokenize with cl100k_base regardless of the chat model.
+EMBED_ENCODING = "cl100k_base"
+COUNT_CACHE_SIZE = 4096
+# Below this length hashing costs about as much as encoding.
+COUNT_CACHE_MIN_CHARS = 64
+
+_chat_model: Optional[str] = None
+_count_cache: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+_count_lock = threading.Lock()
+
+
+def set_chat_model(model: Optional[str]) -> None:
+    """Select the tokenizer used by count_tokens from the configured chat model."""
+    global _chat_model
+    _chat_model = model
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding_named(name: str):
+    return tiktoken.get_encoding(name)
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding_for_model(model: Optional[str]):
+    if model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+    return _encoding_named(DEFAULT_ENCODING)
+
+
+def _encoding():
     if not tiktoken:
-        # Rough fallback: 1.3 tokens per word approximation.
-        return [0] * max(1, int(len(text.split()) * 1.3))
-    enc = tiktoken.get_encoding("cl100k_base")
-    return enc.encode(text)
+        return None
+    return _encoding_for_model(_chat_model)
+
+
+def tokenizer_id() -> str:
+    enc = _encoding()
+    return f"tiktoken:{enc.name}" if enc is not None else "approx:words*1.3"
+
+
+def token_offsets(text: str, encoding: str = EMBED_ENCODING) -> List[int]:
+    """Character offset where each token of text starts, from a single encode.
+
+    Without tiktoken, whitespace-separated words stand in for tokens.
+    """
+    if not tiktoken:
+        return [m.start() for m in re.finditer(r"\S+", text)]
+    enc = _encoding_named(encoding)
+    _, offsets = enc.decode_with_offsets(enc.encode_ordinary(text))
+    return offsets
 
 
 def count_tokens(text: str) -> int:
-    return len(_encode(text or ""))
+    text = text or ""
+    enc = _encoding()
+    if enc is None:
+        # Rough fallback: 1.3 tokens per word approximation.
+        return max(1, int(len(text.split()) * 1.3))
+    if len(text) < COUNT_CACHE_MIN_CHARS:
+        return len(enc.encode_ordinary(text))
+    key = (enc.name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    with _count_lock:
+        cached = _count_cache.get(key)
+        if cached is not None:
+            _count_cache.move_to_end(key)
+            return cached
+    n = len(enc.encode_ordinary(text))
+    with _count_lock:
+        _count_cache[key] = n
+        if len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return n
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    """The longest prefix of text within limit tokens, ending on a line break when one is near."""
+    if count_tokens(text) <= limit:
+        return text
+    enc = _encoding()
+    if enc is None:
+        words = [m.start() for m in re.finditer(r"\S+", text)]
+        cut = words[int(limit / 1.3)] if int(limit / 1.3) < len(words) else len(text)
+    else:
+        _, offsets = enc.decode_with_offsets(enc.encode_ordinary(text))
+        cut = offsets[limit]
+    prefix = text[:cut]
+    line = prefix.rfind("\n")
+    return (prefix[:line] if line > cut // 2 else prefix).rstrip()
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """Token count of a message, stamped on it with the tokenizer that produced it.
+
+    The stored count is reused until the active tokenizer changes.
+    """
+    tokenizer = tokenizer_id()
+    if message.get("tokenizer") == tokenizer and isinstance(message.get("tokens"), int):
+        return message["tokens"]
+    n = count_tokens(message.get("content", ""))
+    message["tokens"] = n
+    message["tokenizer"] = tokenizer
+    return n
 
 
 def messages_token_count(messages: Iterable[Dict[str, Any]]) -> int:
-    return sum(count_tokens(m.get("content", "")) for m in messages)
+    return sum(message_tokens(m) for m in messages)
+
 
+def trim_messages_to_budget(
+    messages: List[Dict[str, Any]],
+    budget: int,
+    reserve: int = 0,
+    counts: Optional[List[int]] = None,
+) -> List[Dict[str, Any]]:
+    """Drop oldest messages until token count fits within budget minus reserve.
 
-def trim_messages_to_budget(messages: List[Dict[str, Any]], budget: int, reserve: int = 0) -> List[Dict[str, Any]]:
-    """Drop oldest messages until token count fits within budget minus reserve."""
-    result = list(messages)
-    while result and messages_token_count(result) > max(0, budget - reserve):
-        result.pop(0)
-    return result
+    Messages with "pinned": true are never dropped; their tokens are charged
+    first and the newest unpinned messages fill what is left. One backward pass
+    over per-message counts (pass counts to skip re-tokenizing).
+    """
+    if counts is None:
+        counts = [message_tokens(m) for m in messages]
+    limit = max(0, budget - reserve)
+    remaining = limit - sum(c for m, c in zip(messages, counts) if m.get("pinned"))
+    cut = len(messages)
+    running = 0
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("pinned"):
+            continue
+        running += counts[i]
+        if running > remaining:
+            break
+        cut = i
+    return [m for i, m in enumerate(messages) if i >= cut or m.get("pinned")]
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import itertools
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO
+
+
+class _NullSpan:
+    """What span() returns while tracing is off; entering and set() do nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> bool:
+        return False
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed phase; written to the trace as a JSON line when it ends."""
+
+    __slots__ = ("tracer", "name", "attrs", "id", "parent", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.id = 0
+        self.parent: Optional[int] = None
+        self.start = 0.0
+
+    def set(self, **attrs: Any) -> None:
+        """Attach sizes known only once the work is done (bytes read, chunks scored...)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        stack = self.tracer.stack()
+        # Spans opened on worker threads hang off the command's root span.
+        self.parent = stack[-1].id if stack else self.tracer.root
+        self.id = next(self.tracer.ids)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> bool:
+        end = time.perf_counter()
+        self.tracer.stack().pop()
+        record = {
+            "id": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "start_ms": round((self.start - self.tracer.t0) * 1000, 3),
+            "ms": round((end - self.start) * 1000, 3),
+            "thread": threading.current_thread().name,
+            **self.attrs,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        self.tracer.write(record)
+        return False
+
+
+class Tracer:
+    """Writes finished spans to a JSONL file; safe to use from several threads."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.t0 = time.perf_counter()
+        self.ids = itertools.count(1)
+        self.root: Optional[int] = None
+        self.counters: Dict[str, int] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._fh: TextIO = path.open("w", encoding="utf-8")
+
+    def stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def count(self, name: str, n: int) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=True, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            self._fh.write(line)
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
+
+_tracer: Optional[Tracer] = None
+_root: Optional[Span] = None
+
+
+def enabled() -> bool:
+    """Whether spans are being recorded; guard size computations that cost something."""
+    return _tracer is not None
+
+
+def span(name: str, **attrs: Any) -> Any:
+    """Context manager timing one phase: `with span("retrieve.rank", chunks=n) as s: ... s.set(hits=3)`."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, attrs)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add to a run-wide counter (e.g. subprocesses); the totals go on the root span."""
+    if _tracer is not None:
+        _tracer.count(name, n)
+
+
+def start(path: Path, command: str) -> None:
+    """Trace the rest of the run to path, under a root span named after the command."""
+    global _tracer, _root
+    _tracer = Tracer(path)
+    _root = Span(_tracer, command, {})
+    _root.__enter__()
+    _tracer.root = _root.id
+
+
+def stop() -> None:
+    """Close the root span (with the counters) and the trace file."""
+    global _tracer, _root
+    if _tracer is None or _root is None:
+        return
+    _root.set(**_tracer.counters)
+    _root.__exit__(None, None, None)
+    _tracer.close()
+    _tracer = _root = None
@@ -1,9 +1,19 @@
+import hashlib
+import importlib.util
 import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from types import ModuleType
+from typing import Any, Dict, Iterable, Iterator, Optional
 
 import click
 
+from .tracing import span
+
 
 def ensure_parent(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
@@ -18,9 +28,16 @@ def read_json(path: Path, default: Any) -> Any:
         raise click.ClickException(f"Failed to parse JSON at {path}: {exc}") from exc
 
 
-def write_json(path: Path, data: Any) -> None:
+def write_text(path: Path, text: str) -> None:
+    """Write via a temp file and rename so readers never see a partial file."""
     ensure_parent(path)
-    path.write_text(json.dumps(data, indent=2, ensure_ascii=True), encoding="utf-8")
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def write_json(path: Path, data: Any) -> None:
+    write_text(path, json.dumps(data, indent=2, ensure_ascii=True))
 
 
 def path_str(path: Path) -> str:
@@ -28,3 +45,87 @@ def path_str(path: Path) -> str:
         return str(path.relative_to(Path.cwd()))
     except ValueError:
         return str(path)
+
+
+# Size of the chunks digest that docs_index sidecar files end with.
+DIGEST_BYTES = 16
+
+
+def chunks_digest(chunks: Iterable[Dict[str, Any]]) -> str:
+    """Content hash of docs_index chunks (ids and texts, in order).
+
+    Sidecars carry it and docs_index records it, so a sidecar taken from
+    another commit than its docs_index (e.g. by a merge) is noticed.
+    """
+    h = hashlib.blake2b(digest_size=DIGEST_BYTES)
+    for ch in chunks:
+        h.update(str(ch.get("id")).encode("utf-8"))
+        h.update(b"\0")
+        h.update(ch.get("text", "").encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def read_digest(path: Path) -> Optional[str]:
+    """The chunks digest a binary sidecar ends with; None if the file is missing or too short."""
+    try:
+        with path.open("rb") as fh:
+            fh.seek(-DIGEST_BYTES, os.SEEK_END)
+            return fh.read().hex()
+    except OSError:
+        return None
+
+
+class _LazyModule(ModuleType):
+    """Placeholder that imports the real module on first attribute access.
+
+    Used instead of importlib.util.LazyLoader, whose module other threads can
+    see half-executed while the first access is still running it.
+    """
+
+    def __getattr__(self, attr: str) -> Any:
+        # import_module holds the module's import lock, so a thread racing the
+        # first access waits for a fully initialized module.
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> Optional[ModuleType]:
+    """Return `name` as a module that is only imported on first attribute access.
+
+    None if it is not installed, so the `X is None` optional-dependency checks
+    keep working without paying the import.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        return None
+    return _LazyModule(name)
+
+
+class Timings:
+    """Wall-clock seconds per named phase; phases may run on several threads."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, secs: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + secs
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a phase; it is also a span in the --trace output."""
+        start = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self) -> str:
+        parts = [f"{name} {secs:.2f}s" for name, secs in self.phases.items()]
+        return "  ".join(parts) + f" | wall {time.perf_counter() - self.start:.2f}s"
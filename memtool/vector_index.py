@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import heapq
+import math
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple
+
+from .utils import lazy_import
+
+np = lazy_import("numpy")
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .embedding_store import EmbeddingMatrix
+
+
+def _normalize(vec: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    if norm == 0:
+        return []
+    return [x / norm for x in vec]
+
+
+class VectorIndex:
+    """Cosine-similarity index over docs_index embeddings.
+
+    Rows are normalized once at build time so a query is scored with a single
+    matrix-vector product. Falls back to pure Python when NumPy is missing.
+    """
+
+    def __init__(self, vectors: List[Sequence[float]], dim: int) -> None:
+        self.dim = dim
+        self.size = len(vectors)
+        # Rows with a zero norm or the wrong dimension never match (score -1.0).
+        self._valid = [bool(v) and len(v) == dim for v in vectors]
+        if np is not None:
+            matrix = np.zeros((self.size, dim), dtype=np.float32)
+            for row, vec in enumerate(vectors):
+                if self._valid[row]:
+                    matrix[row] = vec
+            norms = np.linalg.norm(matrix, axis=1)
+            zero = norms == 0
+            norms[zero] = 1.0
+            matrix /= norms[:, None]
+            self._invalid_mask = zero
+            self._matrix = np.ascontiguousarray(matrix)
+            self._rows = None
+        else:
+            self._matrix = None
+            self._rows = [_normalize(v) if ok else [] for v, ok in zip(vectors, self._valid)]
+
+    @classmethod
+    def from_chunks(cls, chunks: List[Dict[str, Any]]) -> "VectorIndex":
+        vectors = [ch.get("embedding") or [] for ch in chunks]
+        dim = next((len(v) for v in vectors if v), 0)
+        return cls(vectors, dim)
+
+    @classmethod
+    def from_matrix(cls, matrix: "EmbeddingMatrix") -> "VectorIndex":
+        """Wrap an already-normalized EmbeddingMatrix without copying it."""
+        index = cls.__new__(cls)
+        index.dim = matrix.dim
+        index.size = len(matrix)
+        if np is not None:
+            index._matrix = matrix.as_numpy() if index.size else np.zeros((0, index.dim), dtype=np.float32)
+            index._invalid_mask = np.zeros(index.size, dtype=bool)
+            index._rows = None
+        else:
+            index._matrix = None
+            index._rows = list(matrix.rows())
+        return index
+
+    def __len__(self) -> int:
+        return self.size
+
+    def scores(self, query: Sequence[float]) -> List[float]:
+        if np is not None:
+            return self._np_scores(query).tolist()
+        return self._py_scores(query)
+
+    def search(self, query: Sequence[float], k: int) -> List[Tuple[float, int]]:
+        """Return up to k (score, row) pairs, best first."""
+        if k <= 0 or not self.size or len(query) != self.dim:
+            return []
+        k = min(k, self.size)
+        if np is not None:
+            scores = self._np_scores(query)
+            if k < self.size:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(self.size)
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(float(scores[i]), int(i)) for i in top]
+        scores = self._py_scores(query)
+        return [(s, i) for i, s in heapq.nlargest(k, enumerate(scores), key=lambda x: x[1])]
+
+    def _np_scores(self, query: Sequence[float]):
+        q = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if len(q) != self.dim or norm == 0:
+            return np.full(self.size, -1.0, dtype=np.float32)
+        scores = self._matrix @ (q / norm)
+        scores[self._invalid_mask] = -1.0
+        return scores
+
+    def _py_scores(self, query: Sequence[float]) -> List[float]:
+        q = _normalize(query) if len(query) == self.dim else []
+        if not q:
+            return [-1.0] * self.size
+        return [sum(x * y for x, y in zip(row, q)) if row else -1.0 for row in self._rows]